@@ -21,8 +21,13 @@ def main():
         print("Fatal error couldn't continue. Terminating")
         return
     
-    while mqtt_link.run():
-        pass
+    if cfg.ASYNC_MODE:
+        import mqtt_link_async
+        mqtt_link_async.run()
+    else:
+        while mqtt_link.run():
+            # sleep until the next link deadline or incoming message
+            mqtt_link.idle()
 
     mqtt_link.close_controller()
         
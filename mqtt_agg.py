@@ -0,0 +1,109 @@
+"""
+Sensor aggregation windows
+
+Sensor results sampled between publications are kept as min, max, mean
+and last value of every sensor field in fixed size arrays
+
+(c) Dr. Dobermann, 2018.
+"""
+
+from array import array
+
+import mqtt_bin
+
+
+class Aggregate():
+    """
+    Aggregation window of fixed point sensor fields
+
+    ftypes is the sensor FIELDS tuple. Sums are kept as 64 bit
+    integers, so pressure in Pa*100 doesn't overflow on long windows
+    """
+
+    def __init__(self, ftypes):
+        n = len(ftypes)
+        self.ftypes = ftypes
+        self.min = array("l", [0] * n)
+        self.max = array("l", [0] * n)
+        self.last = array("l", [0] * n)
+        self.sum = array("q", [0] * n)
+        self.count = 0
+
+    def add(self, sensor):
+        """
+        Adds the last sensor result to the window
+        """
+        for ii in range(len(self.ftypes)):
+            v = sensor.fixed(ii)
+            if self.count == 0 or v < self.min[ii]:
+                self.min[ii] = v
+            if self.count == 0 or v > self.max[ii]:
+                self.max[ii] = v
+            self.last[ii] = v
+            self.sum[ii] += v
+        self.count += 1
+
+    def reset(self):
+        """
+        Starts new window
+        """
+        for ii in range(len(self.ftypes)):
+            self.sum[ii] = 0
+        self.count = 0
+
+    def mean(self, i):
+        return self.sum[i] // self.count
+
+    def frame_size(self):
+        """
+        Returns the size of the binary frame of the window
+        """
+        return mqtt_bin.HEADER_SIZE + mqtt_bin.SAMPLES_SIZE + \
+               len(self.ftypes) * mqtt_bin.AGG_FIELD_SIZE
+
+    def frame(self, buf, uptime):
+        """
+        Writes the window as binary frame into buf and returns its size
+        """
+        n = mqtt_bin.put_header(buf, mqtt_bin.AGGREGATE, uptime, len(self.ftypes))
+        n = mqtt_bin.put_samples(buf, n, self.count)
+        for ii in range(len(self.ftypes)):
+            n = mqtt_bin.put_agg_field(buf, n, self.ftypes[ii], self.min[ii],
+                                       self.mean(ii), self.max[ii], self.last[ii])
+
+        return n
+
+    def text(self):
+        """
+        Returns the window as text
+
+        b"{samples}:{field} {min} {mean} {max} {last}:..."
+        """
+        r = str(self.count)
+        for ii in range(len(self.ftypes)):
+            name, scale = mqtt_bin.fields.get(self.ftypes[ii], (str(self.ftypes[ii]), 1))
+            r += ":{} {} {} {} {}".format(name, fixed_str(self.min[ii], scale),
+                                          fixed_str(self.mean(ii), scale),
+                                          fixed_str(self.max[ii], scale),
+                                          fixed_str(self.last[ii], scale))
+
+        return r.encode()
+#------------------------------------------------------------------------------
+
+
+
+def fixed_str(v, scale):
+    """
+    Formats fixed point value without floats
+    """
+    if scale == 1:
+        return str(v)
+
+    sign = ""
+    if v < 0:
+        sign = "-"
+        v = -v
+    frac = str(v % scale)
+    frac = "0" * (len(str(scale)) - 1 - len(frac)) + frac
+
+    return "{}{}.{}".format(sign, v // scale, frac)
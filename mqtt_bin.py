@@ -0,0 +1,230 @@
+"""
+Binary payload frames
+
+Frame is a big endian struct:
+    version     B
+    kind        B   link tool type, one of SENSOR, MOSFET, SWITCH, BUTTON
+    uptime      I   seconds
+    count       B   number of fields
+    fields      count times of
+        type    B   field type mqtt_link_consts.F_*
+        value   i   fixed point value
+
+Sensor aggregate frame (kind AGGREGATE) has the number of aggregated
+samples H after the header and its fields are
+        type    B
+        min     i
+        mean    i
+        max     i
+        last    i
+
+Sensor history frame (kind HISTORY) has the number of samples H and
+the age in seconds of the newest one I after the header, then count
+field types B and samples from the oldest one:
+        delta   H   seconds since the previous sample
+        values      count times of h for NARROW_FIELDS and i for others
+
+Module has no dependencies on the board, so decode() could be used
+on the host side as well
+
+(c) Dr. Dobermann, 2018.
+"""
+
+import struct
+
+import mqtt_link_consts as mlc
+
+VERSION = 1
+
+# frame kinds
+SENSOR = 1
+MOSFET = 2
+SWITCH = 3
+BUTTON = 4
+AGGREGATE = 5
+HISTORY = 6
+
+HEADER = "!BBIB"
+HEADER_SIZE = struct.calcsize(HEADER)
+FIELD = "!Bi"
+FIELD_SIZE = struct.calcsize(FIELD)
+SAMPLES = "!H"
+SAMPLES_SIZE = struct.calcsize(SAMPLES)
+AGG_FIELD = "!Biiii"
+AGG_FIELD_SIZE = struct.calcsize(AGG_FIELD)
+AGE = "!I"
+AGE_SIZE = struct.calcsize(AGE)
+DELTA = "!H"
+DELTA_SIZE = struct.calcsize(DELTA)
+
+# fields which fixed point values fit into 16 bits
+NARROW_FIELDS = (mlc.F_TEMP, mlc.F_RHUM)
+
+# field names and scales for decoding
+fields = {
+    mlc.F_TEMP:     ("temp", 100),
+    mlc.F_PRESSURE: ("pressure", 100),
+    mlc.F_RHUM:     ("rhum", 100),
+    mlc.F_STATE:    ("state", 1),
+    mlc.F_SINCE:    ("since", 1),
+    mlc.F_TIMEOUT:  ("timeout", 1),
+    mlc.F_MAX_TIME: ("max_time", 1)
+}
+
+kinds = {
+    SENSOR: "SENSOR_I2C",
+    MOSFET: "MOSFET",
+    SWITCH: "SWITCH",
+    BUTTON: "BUTTON",
+    AGGREGATE: "SENSOR_AGG",
+    HISTORY: "SENSOR_HIST"
+}
+
+
+def put_header(buf, kind, uptime, count):
+    """
+    Writes frame header into buf and returns the position of the first field
+    """
+    struct.pack_into(HEADER, buf, 0, VERSION, kind, uptime, count)
+
+    return HEADER_SIZE
+
+
+
+def put_field(buf, pos, ftype, v):
+    """
+    Writes single field and returns the position after it
+    """
+    struct.pack_into(FIELD, buf, pos, ftype, v)
+
+    return pos + FIELD_SIZE
+
+
+
+def put_samples(buf, pos, samples):
+    """
+    Writes the number of aggregated samples and returns the position after it
+    """
+    struct.pack_into(SAMPLES, buf, pos, samples)
+
+    return pos + SAMPLES_SIZE
+
+
+
+def put_agg_field(buf, pos, ftype, vmin, vmean, vmax, vlast):
+    """
+    Writes single aggregate field and returns the position after it
+    """
+    struct.pack_into(AGG_FIELD, buf, pos, ftype, vmin, vmean, vmax, vlast)
+
+    return pos + AGG_FIELD_SIZE
+
+
+
+def put_value(buf, pos, ftype, v):
+    """
+    Writes single history value and returns the position after it
+    """
+    if ftype in NARROW_FIELDS:
+        struct.pack_into("!h", buf, pos, v)
+        return pos + 2
+
+    struct.pack_into("!i", buf, pos, v)
+
+    return pos + 4
+
+
+
+def value_size(ftype):
+    """
+    Returns the size of history value of the field type
+    """
+    if ftype in NARROW_FIELDS:
+        return 2
+
+    return 4
+
+
+
+def decode_history(frame, pos, count, res):
+    """
+    Decodes history samples into res["samples"] as (age, values) tuples
+    from the oldest one, age is in seconds before the frame uptime
+    """
+    n = struct.unpack_from(SAMPLES, frame, pos)[0]
+    pos += SAMPLES_SIZE
+    age = struct.unpack_from(AGE, frame, pos)[0]
+    pos += AGE_SIZE
+    ftypes = struct.unpack_from("{}B".format(count), frame, pos)
+    pos += count
+    for ft in ftypes:
+        res["fields"].append(fields.get(ft, (ft, 1))[0])
+
+    samples = []
+    t = 0
+    for ii in range(n):
+        t += struct.unpack_from(DELTA, frame, pos)[0]
+        pos += DELTA_SIZE
+        v = []
+        for ft in ftypes:
+            if ft in NARROW_FIELDS:
+                x = struct.unpack_from("!h", frame, pos)[0]
+            else:
+                x = struct.unpack_from("!i", frame, pos)[0]
+            pos += value_size(ft)
+            scale = fields.get(ft, (ft, 1))[1]
+            v.append(x / scale if scale != 1 else x)
+        samples.append((t, tuple(v)))
+
+    # ages are counted back from the newest sample
+    res["samples"] = [(age + t - st, v) for st, v in samples]
+
+    return res
+
+
+
+def decode(frame):
+    """
+    Decodes the frame into dictionary
+
+    {"version": 1, "kind": "MOSFET", "uptime": 10,
+     "fields": [("state", 1), ("since", 3), ...]}
+    Fields are kept in the frame order since combined sensors could
+    have several fields of the same type. Fixed point fields are
+    converted into floats.
+    Aggregate frame has "samples" item and its field values are
+    (min, mean, max, last) tuples.
+    History frame has field names in "fields" and "samples" list
+    of (age, values) tuples (see decode_history)
+    """
+    version, kind, uptime, count = struct.unpack_from(HEADER, frame, 0)
+    if version != VERSION:
+        raise ValueError("Unsupported frame version {}".format(version))
+
+    res = {"version": version, "kind": kinds.get(kind, kind), "uptime": uptime, "fields": []}
+    pos = HEADER_SIZE
+    if kind == HISTORY:
+        return decode_history(frame, pos, count, res)
+
+    if kind == AGGREGATE:
+        res["samples"] = struct.unpack_from(SAMPLES, frame, pos)[0]
+        pos += SAMPLES_SIZE
+
+    for ii in range(count):
+        if kind == AGGREGATE:
+            v = struct.unpack_from(AGG_FIELD, frame, pos)
+            pos += AGG_FIELD_SIZE
+            ftype = v[0]
+            v = v[1:]
+        else:
+            ftype, v = struct.unpack_from(FIELD, frame, pos)
+            pos += FIELD_SIZE
+        name, scale = fields.get(ftype, (ftype, 1))
+        if scale != 1:
+            if kind == AGGREGATE:
+                v = tuple([x / scale for x in v])
+            else:
+                v = v / scale
+        res["fields"].append((name, v))
+
+    return res
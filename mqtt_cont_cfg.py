@@ -10,6 +10,9 @@ import mqtt_link_consts as mlc
 
 MQTT_CLI_NAME = b"esp_01"
 
+# run controller over uasyncio tasks instead of mqtt_link.run() cycle
+ASYNC_MODE = False
+
 # mqtt_links dictionary format described in README.md
 # 
 mqtt_links = { 
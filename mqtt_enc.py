@@ -0,0 +1,105 @@
+"""
+Replies encoder
+
+Functions write reply parts into preallocated bytearray buffers
+without creating new bytes objects. Every function gets the buffer
+and the position to write from and returns the position after
+written data
+
+(c) Dr. Dobermann, 2018.
+"""
+
+SPACE = 0x20 # b" "
+COLON = 0x3A # b":"
+SLASH = 0x2F # b"/"
+MINUS = 0x2D # b"-"
+DOT   = 0x2E # b"."
+ZERO  = 0x30 # b"0"
+NEWLINE = 0x0A # b"\n"
+
+
+def put_byte(buf, pos, c):
+    """
+    Writes single byte code c
+    """
+    buf[pos] = c
+
+    return pos + 1
+
+
+
+def put_bytes(buf, pos, b):
+    """
+    Writes bytes b
+
+    Raises IndexError if b doesn't fit into buf, slice assignment
+    would resize bytearray buffer instead
+    """
+    end = pos + len(b)
+    if end > len(buf):
+        raise IndexError("reply buffer overflow")
+    buf[pos:end] = b
+
+    return end
+
+
+
+def put_str(buf, pos, s):
+    """
+    Writes ASCII string s
+    """
+    # str couldn't be assigned to the buffer slice as is
+    return put_bytes(buf, pos, s.encode())
+
+
+
+def put_int(buf, pos, v):
+    """
+    Writes decimal representation of integer v
+    """
+    if v < 0:
+        buf[pos] = MINUS
+        pos += 1
+        v = -v
+
+    # count digits
+    n = 1
+    d = v
+    while d >= 10:
+        d //= 10
+        n += 1
+
+    end = pos + n
+    while n > 0:
+        n -= 1
+        buf[pos + n] = ZERO + v % 10
+        v //= 10
+
+    return end
+
+
+
+def put_fixed(buf, pos, v, scale):
+    """
+    Writes fixed point value v with scale (power of 10) without floats
+    """
+    if scale == 1:
+        return put_int(buf, pos, v)
+
+    if v < 0:
+        buf[pos] = MINUS
+        pos += 1
+        v = -v
+
+    pos = put_int(buf, pos, v // scale)
+    buf[pos] = DOT
+    pos += 1
+    # fraction digits with leading zeros
+    scale //= 10
+    v %= scale * 10
+    while scale > 0:
+        buf[pos] = ZERO + v // scale % 10
+        pos += 1
+        scale //= 10
+
+    return pos
@@ -0,0 +1,61 @@
+"""
+Pin events ring
+
+Pin interrupt handlers put edge events into the ring and the main cycle
+drains it. Ring has a single producer (interrupt handlers) and a single
+consumer (main cycle), so it doesn't need any locks. put() doesn't
+allocate memory and could be called from interrupt handler
+
+(c) Dr. Dobermann, 2018.
+"""
+
+from array import array
+
+
+class EventRing():
+    """
+    Fixed size ring of (source id, ticks) events
+
+    Events are dropped if the ring is full and overflow flag is set
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self.ids = array("H", [0] * size)
+        self.times = array("L", [0] * size)
+        # head is moved only by the producer, tail only by the consumer
+        self.head = 0
+        self.tail = 0
+        self.overflow = False
+
+    def put(self, sid, t):
+        """
+        Adds the event. Called from interrupt handler
+        """
+        h = self.head + 1
+        if h == self.size:
+            h = 0
+        if h == self.tail:
+            self.overflow = True
+            return
+        self.ids[self.head] = sid
+        self.times[self.head] = t
+        self.head = h
+
+    def drain(self, fn):
+        """
+        Calls fn(source id, ticks) for every event in the ring
+
+        Returns the number of processed events
+        """
+        n = 0
+        while self.tail != self.head:
+            fn(self.ids[self.tail], self.times[self.tail])
+            t = self.tail + 1
+            if t == self.size:
+                t = 0
+            self.tail = t
+            n += 1
+
+        return n
+#------------------------------------------------------------------------------
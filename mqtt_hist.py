@@ -0,0 +1,205 @@
+"""
+Sensor history
+
+Sensor results are kept in the fixed size ring of fixed point arrays
+with relative timestamps, so readings taken while mqtt server is
+unreachable could be retrieved later in a single message
+
+(c) Dr. Dobermann, 2018.
+"""
+
+import struct
+from array import array
+from utime import ticks_ms, ticks_add, ticks_diff
+
+import mqtt_bin
+import mqtt_enc as enc
+
+# the longest time between samples in seconds kept exactly
+MAX_DELTA = 0xFFFF
+# the longest text of the sample age and of the integer part of a value
+AGE_TEXT = 10
+INT_TEXT = 11
+
+
+class History():
+    """
+    Ring of the last size sensor results
+
+    ftypes is the sensor FIELDS tuple. Values of NARROW_FIELDS are kept
+    in 16 bits arrays, the others in 32 bits ones. Every sample keeps
+    the number of seconds since the previous one, longer gaps are
+    saturated to MAX_DELTA
+    """
+
+    def __init__(self, ftypes, size):
+        self.ftypes = ftypes
+        self.size = size
+        self.values = []
+        for ft in ftypes:
+            if ft in mqtt_bin.NARROW_FIELDS:
+                self.values.append(array("h", [0] * size))
+            else:
+                self.values.append(array("l", [0] * size))
+        self.delta = array("H", [0] * size)
+        # index of the next sample and number of kept samples
+        self.head = 0
+        self.count = 0
+        # time of the newest sample rounded by seconds since the first one
+        self.last = 0
+        # sensor result id of the newest sample
+        self.results = -1
+        # reply buffer is allocated on the first request
+        self.buf = None
+
+    def add(self, sensor):
+        """
+        Adds the last sensor result to the ring
+
+        The result served again from the sensor cache isn't added
+        """
+        if sensor.result_id() == self.results:
+            return
+        self.results = sensor.result_id()
+        self.put(sensor.fixed)
+
+    def put(self, value):
+        """
+        Adds the sample which i-th field fixed point value is value(i)
+        """
+        t = ticks_ms()
+        d = 0
+        if self.count > 0:
+            d = ticks_diff(t, self.last) // 1000
+            if d > MAX_DELTA:
+                d = MAX_DELTA
+                self.last = t
+            else:
+                self.last = ticks_add(self.last, d * 1000)
+        else:
+            self.last = t
+
+        for ii in range(len(self.ftypes)):
+            v = value(ii)
+            if self.values[ii].typecode == "h":
+                v = max(-0x8000, min(0x7FFF, v))
+            self.values[ii][self.head] = v
+        self.delta[self.head] = d
+        self.head = (self.head + 1) % self.size
+        if self.count < self.size:
+            self.count += 1
+
+    def window(self, n):
+        """
+        Returns the ring index of the first of the newest n samples
+        and their number
+        """
+        if n == None or n <= 0 or n > self.count:
+            n = self.count
+
+        return (self.head - n) % self.size, n
+
+    def age(self):
+        """
+        Returns the age of the newest sample in seconds
+        """
+        if self.count == 0:
+            return 0
+
+        return ticks_diff(ticks_ms(), self.last) // 1000
+
+    def frame_size(self, n):
+        """
+        Returns the size of the binary frame of n samples
+        """
+        sz = mqtt_bin.DELTA_SIZE
+        for ft in self.ftypes:
+            sz += mqtt_bin.value_size(ft)
+
+        return mqtt_bin.HEADER_SIZE + mqtt_bin.SAMPLES_SIZE + mqtt_bin.AGE_SIZE + \
+               len(self.ftypes) + n * sz
+
+    def frame(self, uptime, n):
+        """
+        Writes the newest n samples as binary frame into the history
+        buffer and returns its size
+        """
+        buf = self.reply_buf(self.frame_size(self.size))
+
+        first, n = self.window(n)
+        pos = mqtt_bin.put_header(buf, mqtt_bin.HISTORY, uptime, len(self.ftypes))
+        pos = mqtt_bin.put_samples(buf, pos, n)
+        struct.pack_into(mqtt_bin.AGE, buf, pos, self.age())
+        pos += mqtt_bin.AGE_SIZE
+        for ft in self.ftypes:
+            buf[pos] = ft
+            pos += 1
+
+        for jj in range(n):
+            ii = (first + jj) % self.size
+            # the oldest sample of the window has no previous one
+            struct.pack_into(mqtt_bin.DELTA, buf, pos, self.delta[ii] if jj > 0 else 0)
+            pos += mqtt_bin.DELTA_SIZE
+            for kk in range(len(self.ftypes)):
+                pos = mqtt_bin.put_value(buf, pos, self.ftypes[kk], self.values[kk][ii])
+
+        return pos
+
+    def text_size(self, n):
+        """
+        Returns the size of the longest text of n samples
+        """
+        sz = AGE_TEXT + 1
+        hdr = AGE_TEXT + 1
+        for ft in self.ftypes:
+            name, scale = mqtt_bin.fields.get(ft, (str(ft), 1))
+            hdr += len(name) + 1
+            sz += 1 + INT_TEXT + len(str(scale))
+
+        return hdr + n * sz
+
+    def text(self, n):
+        """
+        Writes the newest n samples as text from the oldest one into
+        the history buffer and returns its size
+
+        b"{samples}:{field} {field}...\n{age} {value} {value}...\n..."
+        """
+        buf = self.reply_buf(self.text_size(self.size))
+        first, n = self.window(n)
+
+        pos = enc.put_int(buf, 0, n)
+        sep = enc.COLON
+        for ft in self.ftypes:
+            pos = enc.put_byte(buf, pos, sep)
+            pos = enc.put_str(buf, pos, mqtt_bin.fields.get(ft, (str(ft), 1))[0])
+            sep = enc.SPACE
+        pos = enc.put_byte(buf, pos, enc.NEWLINE)
+
+        # ages are counted back from the newest sample
+        a = self.age()
+        for jj in range(first + 1, first + n):
+            a += self.delta[jj % self.size]
+
+        for jj in range(n):
+            ii = (first + jj) % self.size
+            if jj > 0:
+                a -= self.delta[ii]
+            pos = enc.put_int(buf, pos, a)
+            for kk in range(len(self.ftypes)):
+                pos = enc.put_byte(buf, pos, enc.SPACE)
+                pos = enc.put_fixed(buf, pos, self.values[kk][ii],
+                                    mqtt_bin.fields.get(self.ftypes[kk], ("", 1))[1])
+            pos = enc.put_byte(buf, pos, enc.NEWLINE)
+
+        return pos
+
+    def reply_buf(self, sz):
+        """
+        Returns the reply buffer of at least sz bytes
+        """
+        if self.buf == None or len(self.buf) < sz:
+            self.buf = bytearray(sz)
+
+        return self.buf
+#------------------------------------------------------------------------------
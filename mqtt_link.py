@@ -4,17 +4,73 @@ Module provides functionality for mqtt links processing
 (c) Dr. Dobermann, 2018.
 """
 
-from umqtt.robust import MQTTClient
 from machine import Pin
 import utime
+import uselect
+from array import array
 
 import mqtt_link_consts as mlc
+import mqtt_enc as enc
+import mqtt_bin
+from mqtt_sched import Scheduler
+from mqtt_pubq import PublishQueue
+from mqtt_session import Session
+from mqtt_stats import Stats
+from mqtt_mem import Memory
+from mqtt_agg import Aggregate
+from mqtt_hist import History
+from mqtt_events import EventRing
+from mqtt_link_types import MosfetLink, MosfetGroup, SwitchLink, I2CSensorLink, ButtonLink
 
 # Constants
 #------------------------------------------------------------------------------
 CHECK_TIMEOUT     = 1 * 1000   # milliseconds
 KEEP_ALIVE_TIMOUT = 300 * 1000 # milliseconds
 
+# pin events
+DEBOUNCE_TIMEOUT = 30      # milliseconds pin should be stable after the last edge
+LONG_PRESS_TIMEOUT = 1000  # milliseconds
+EVENTS_RING_SIZE = 32      # events
+EVENTS_CHECK_TIMEOUT = 50  # milliseconds to sleep while pin interrupts are used
+
+# outgoing messages queue
+PUB_QUEUE_SIZE = 16     # messages
+PUB_BATCH = 4           # messages published in one run() cycle
+PUB_RATE = 10           # messages per second, 0 means no limit
+PUB_BURST = 5           # messages
+PUB_TOPIC_INTERVAL = 0  # milliseconds between messages on the same topic, 0 means no limit
+PUB_RETRY_TIMEOUT = 50  # milliseconds to sleep while queue isn't empty
+
+# mqtt session
+SESSION_RING_SIZE = 32          # messages kept while the server is unreachable
+SESSION_SPILL = "mqtt_spill.bin" # file for messages which don't fit the ring, None to drop them
+SESSION_SPILL_SIZE = 16 * 1024  # bytes
+RECONNECT_MIN = 500             # milliseconds before the first reconnect attempt
+RECONNECT_MAX = 60 * 1000       # milliseconds, reconnect backoff limit
+
+# memory management
+MEM_RESERVE = 1024      # bytes reserved at startup and released on MemoryError
+EXC_BUF_SIZE = 100      # bytes for exceptions raised in interrupt handlers
+GC_THRESHOLD_PART = 4   # automatic collection after every 1/GC_THRESHOLD_PART of free heap allocated
+GC_MIN_GAP = 10         # milliseconds of idle time needed for scheduled collection
+GC_MIN_ALLOC = 4 * 1024 # bytes allocated since the last collection to collect in idle time
+
+# sensors
+SENSOR_MAX_FAILURES = 5 # failed conversions in a row before the link stops polling the sensor
+
+# subscribe once for b"{cname}/#" and cname instead of every link topic
+SUBSCRIBE_WILDCARD = False
+
+# links bring-up
+STARTUP_SLICE = 20      # milliseconds of links bring-up in one run() cycle
+# bring-up order of tool types, actuators go first
+LINK_PRIORITY = {
+    b"MOSFET": 0,
+    b"BUTTON": 1,
+    b"SWITCH": 1,
+    b"SENSOR_I2C": 2
+    }
+
 # last keep alive reply
 last_kar = 0
 kat = KEEP_ALIVE_TIMOUT
@@ -22,8 +78,12 @@ kat = KEEP_ALIVE_TIMOUT
 
 # Gloabal variables
 #------------------------------------------------------------------------------
-# last mqtt message check time
-check_time = utime.ticks_ms()
+# links deadlines scheduler
+sched = None
+
+# poller for incoming mqtt messages and the socket it's registered for
+poller = None
+poller_sock = None
 
 # mosfet and switch string statuses
 on_off_str = {
@@ -31,148 +91,348 @@ on_off_str = {
     mlc.OFF: b"off"
     }
 
-# link on mqtt links dictionary
+# mqtt link objects by their topics
 ml = dict()
 
+# mosfet groups registry by group id
+groups = dict()
+
+# links waiting for bring-up as [topic, tool type, params] in priority order
+pending = []
+
+# links readiness reports as [status topic, message] waiting for the room
+# in the publish queue
+reports = []
+
+# startup timing: init_controller call ticks, milliseconds until READY
+# and until all links are up (-1 while links are brought up)
+boot_ticks = 0
+ready_time = 0
+up_time = -1
+
+# number of links which failed to initialize
+failed_links = 0
+
 # mqtt client name
 cname = b""
 
-# mqtt client object
+# controller status topic
+cstatus = b""
+
+# buffers for system info and keep alive replies, system info buffer
+# is enlarged on init to keep the client name and SYS_INFO_SIZE bytes more
+SYS_BUF_SIZE = 64
+SYS_INFO_SIZE = 24
+sys_buf = memoryview(bytearray(SYS_BUF_SIZE))
+ka_buf = memoryview(bytearray(SYS_BUF_SIZE))
+
+# mosfet queue line size without the topic: b":{timeout}\n"
+QUEUE_LINE_SIZE = 13
+
+# get_links page buffer, the room for b"next:{cursor}" is kept at its end
+LINKS_PAGE_SIZE = 256
+LINKS_FOOTER_SIZE = 12
+links_buf = memoryview(bytearray(LINKS_PAGE_SIZE))
+
+# links in order of their bring-up, get_links cursor is the index in it
+links = []
+
+# get_links output in progress as [filter, cursor, single page]
+# or None and its last queued page
+links_job = None
+links_page = None
+
+# mqtt session (mqtt_session.Session) used as mqtt client
 mqtt_cli = None
 
-# list of system mqtt verbs and their processors
-sys_verbs = None
+# outgoing messages queue
+pubq = None
+
+# performance counters
+stats = Stats()
+
+# memory manager
+mem = None
+
+# True if performance counters are published with keep alive replies
+stats_steady = False
+
+# pin events captured by interrupts
+events = EventRing(EVENTS_RING_SIZE)
+
+# links which pins are watched by interrupts, event source id is the link index
+pin_links = []
+
+# system mqtt verbs dictionary
+# key is the verb name, value is a list of the verb processor
+# and the kind of the verb argument (ARG_NO, ARG_OPT, ARG_INT)
+sys_verbs = dict()
 
 # list of processors and vers allowed for every tool type linked to mqtt topic
 # it organized as a dictionary with key as tool type from mqtt_links
-# first item is tool processing routine
-# second item is a list of allowed verbs
-# third item is an init procedure for the tool type
-tool_verbs = {
-    b"MOSFET"    :[None, [b"?", b"on", b"off"], None],
-    b"SWITCH"    :[None, [b"?", b"timeout_get", b"timeout_set"], None],
-    b"SENSOR_I2C":[None, [b"?", b"timeout_get", b"timeout_set"], None],
-    b"BUTTON"    :[None, [], None]
-}
+# first item is tool checking routine called when the link deadline is reached
+# second item is a verbs dictionary of the same format as sys_verbs
+# third item is an init procedure which creates the link object for the tool type
+# fourth item returns milliseconds left until the link should be checked
+# or None if the link doesn't need checking
+# all the routines except init get the link object
+tool_verbs = dict()
+
+# verbs dispatch table built on controller initialization
+# it maps topic to the list of the link object and the verbs dictionary
+# of the link's tool type or [None, sys_verbs] for the controller topic
+dispatch = dict()
+
+# verb argument kinds
+ARG_NO  = 0 # verb has no argument
+ARG_OPT = 1 # verb could have an integer argument after ":"
+ARG_INT = 2 # verb should have an integer argument after ":"
+ARG_STR = 3 # verb could have a bytes argument after ":"
 
 # Functions
 #------------------------------------------------------------------------------
 def cb(topic, msg):
     """
     MQTT call back processor
+
+    Verb is found with single lookup in the dispatch table and its
+    argument is parsed here, so verb processors get it ready to use
     """
+    d = dispatch.get(topic)
+    if d == None:
+        # own statuses come back through the wildcard subscription
+        if topic.endswith(b"/status"):
+            return
+        print("==> Got [", msg, "] from unregistered topic [", topic, "]")
+        publish_status(b"ERROR: Unregistered topic: " + topic)
+        return
+    link, verbs = d
 
-    global ml
-    global tool_verbs
-    
     print("==> Got [", msg, "] from topic [", topic, "]")
 
-    if topic in ml:
-        if ml[topic][0] not in tool_verbs:
-            publish_status(b"ERROR: Invalid tool type " + ml[topic][0] + b" linked to topic : " + topic)
-            return
+    i = msg.find(b":")
+    if i == -1:
+        v = verbs.get(msg)
+    else:
+        v = verbs.get(msg[:i])
 
-        # check if the message is equal to any verb in a tool type and if it so, process the message
-        found = False
-        for v in tool_verbs[ml[topic][0]][1]:
-            if msg.startswith(v):
-                found = True
-                break
-        if not found:
-            publish_status(b"ERROR: Unregistered verb:" + msg, topic)
+    if v == None:
+        if topic == cname:
+            publish_status(b"ERROR: Invalid system verb: " + msg)
         else:
-            tool_verbs[ml[topic][0]][0](topic, msg)
+            publish_status(b"ERROR: Unregistered verb:" + msg, link)
+        return
 
-    elif topic == cname:
-        key = None
-        for v in sys_verbs.keys():
-            if msg.startswith(v):
-                key = v
-                break
-        if key == None:
-            publish_status(b"ERROR: Invalid system verb: " + msg)
+    arg = None
+    if i != -1:
+        if v[1] == ARG_NO:
+            publish_status(b"ERROR: Verb doesn't expect an argument: " + msg, link)
             return
-        sys_verbs[key](msg)
+        if v[1] == ARG_STR:
+            arg = msg[i+1:]
+        else:
+            try:
+                arg = int(msg[i+1:], 10)
+            except Exception as e:
+                publish_status(b"ERROR: Invalid argument in " + msg + " fired exception {}".format(e).encode(), link)
+                return
+    elif v[1] == ARG_INT:
+        publish_status(b"ERROR: Verb expects an argument: " + msg, link)
+        return
 
-    else: # despite it's impossible that controller gets topic it isn't subscribed for, I left this here
-        publish_status(b"ERROR: Unregistered topic: " + topic)
+    t0 = utime.ticks_us()
+    try:
+        v[0](link, arg)
+    except MemoryError:
+        out_of_memory(link)
+    except Exception as e:
+        # verb failure isn't a session failure, so it never goes
+        # up to the mqtt client
+        print("ERROR: Verb [", msg, "] fired exception", e)
+        publish_status(b"ERROR: Verb " + msg + " fired exception {}".format(e).encode(), link)
+    stats.call(v[0], t0)
+
+    if link != None:
+        # verb could change the link deadline
+        update_deadline(link)
 
 
 
 def init_controller(cli_name, mqtt_links):
     """
     Prepares controller for work starting
-    initializes mqtt_links
+
+    Connects to mqtt server and publishes READY at once. Links from
+    mqtt_links are only queued here, they are created and subscribed
+    by bring_up() from the main cycle in LINK_PRIORITY order
     """
     global ml
     global cname
     global mqtt_cli
-    global tool_verbs
-
-    ml = mqtt_links
+    global sched
+    global pubq
+    global stats
+    global mem
+    global cstatus
+    global pending
+    global reports
+    global boot_ticks
+    global ready_time
+    global up_time
+    global failed_links
+    global links_job
+    global sys_buf
+
+    boot_ticks = utime.ticks_ms()
+    up_time = -1
+    failed_links = 0
+
+    # reserve memory before links make the heap fragmented
+    if mem == None:
+        mem = Memory(MEM_RESERVE, EXC_BUF_SIZE, GC_THRESHOLD_PART, GC_MIN_GAP, GC_MIN_ALLOC)
+
+    ml = dict()
+    stats = Stats()
+    sched = Scheduler()
+    pubq = PublishQueue(publish, PUB_QUEUE_SIZE, PUB_BATCH, PUB_RATE, PUB_BURST, PUB_TOPIC_INTERVAL)
     cname = cli_name
-
-    groups = dict()
-
-    for t, ma in ml.items():
+    cstatus = cname + b"/status"
+    # b"{cname}:{uptime}:{kat}" shouldn't overflow with a long client name
+    if len(cname) + SYS_INFO_SIZE > len(sys_buf):
+        sys_buf = memoryview(bytearray(len(cname) + SYS_INFO_SIZE))
+    dispatch.clear()
+    dispatch[cname] = [None, sys_verbs]
+    del pin_links[:]
+    del links[:]
+    links_job = None
+    groups.clear()
+
+    pending = []
+    reports = []
+    for t, ma in mqtt_links.items():
         if ma[0] not in tool_verbs:
             print("FATAL: Invalid tool type:", ma[0], "for link", t)
             return None
-
-        else: # run initialization routine for the tool type
-            if tool_verbs[ma[0]][2](ma) != True:
-                print("FATAL: Could not initialize tool type [", ma[0], "] for link [", t, "!!!")
-                return None
-
-            # check mosfet groups
-            if ma[0] == b"MOSFET":
-                if ma[1][3] != mlc.NO_GROUP:
-                    if ma[1][3] not in groups:
-                        groups[ma[1][3]] = [mlc.NO_SEQ, []] # first item is a sequence flag for a group
-                    groups[ma[1][3]][1].append(ma[1][0]) # group consists of pin numbers of mosfets
-                    ma[2].insert(3, groups[ma[1][3]])   # group info holds in 4th item of the run-time objects list
-                    if ma[1][3] == mlc.SEQ:
-                        groups[ma[1][3]][0] = mlc.SEQ
-                        # sequental group has an extra item in a group list which indicates next mosfet to power on
-                        if len(groups[ma[1][3]]) == 2:
-                            # add next mosfet index into group info
-                            # it should be the first item in a group list
-                            groups[ma[1][3]].append(groups[ma[1][3]][1][0])
-                else:
-                    # if mosfet isn't in any group, add an empy group to its run-time
-                    ma[2].insert(3, [mlc.NO_SEQ, []])
+        pending.append([t, ma[0], ma[1]])
+    pending.sort(key = lambda p: LINK_PRIORITY.get(p[1], len(LINK_PRIORITY)))
 
     import mqtt_cfg
     
-    c = MQTTClient(cname, mqtt_cfg.mqtt_srv_name)
-    print("Trying to connect to", mqtt_cfg.mqtt_srv_name)
-    c.DEBUG = True
-    c.connect(clean_session = False)
-    print("Connected")
+    c = Session(cname, mqtt_cfg.mqtt_srv_name, SESSION_RING_SIZE, SESSION_SPILL,
+                SESSION_SPILL_SIZE, RECONNECT_MIN, RECONNECT_MAX, PUB_BATCH)
+    c.cli.DEBUG = True
     c.set_callback(cb)
-
-    # subscribe for mqtt links
-    for mak in ml.keys():
-        c.subscribe(mak)
-        print("Subscribed for", mak)
-
     # subscribe for system mqtt requests
     c.subscribe(cname)
-    print("Subscribed for", cname)
+    if SUBSCRIBE_WILDCARD:
+        # links are routed by the dispatch table
+        c.subscribe(cname + b"/#")
+
+    print("Trying to connect to", mqtt_cfg.mqtt_srv_name)
+    # controller works offline until the session reconnects
+    if c.connect():
+        print("Connected")
 
     mqtt_cli = c
 
     publish_status(b"READY")
+    pubq.drain()
+    ready_time = utime.ticks_diff(utime.ticks_ms(), boot_ticks)
+    print("READY in", ready_time, "ms,", len(pending), "links to bring up")
 
     return c
 
 
 
+def bring_up():
+    """
+    Brings up pending links in priority order no longer than STARTUP_SLICE
+    milliseconds. At least one link is brought up on every call.
+    Once all links are up, publishes b"UP:{links up}:{links failed}:{ms}"
+
+    Links readiness reports are queued only while the publish queue
+    is less than half full, so they don't push out other messages
+    """
+    global up_time
+
+    if len(pending) > 0:
+        t0 = utime.ticks_ms()
+        while len(pending) > 0:
+            p = pending.pop(0)
+            start_link(p[0], p[1], p[2])
+            if utime.ticks_diff(utime.ticks_ms(), t0) >= STARTUP_SLICE:
+                break
+
+        if len(pending) == 0:
+            up_time = utime.ticks_diff(utime.ticks_ms(), boot_ticks)
+            print("All links are up in", up_time, "ms")
+            publish_status("UP:{}:{}:{}".format(len(ml), failed_links, up_time).encode())
+
+    while len(reports) > 0 and pubq.free() > pubq.size // 2:
+        r = reports.pop(0)
+        pubq.put(r[0], r[1])
+
+
+
+def start_link(t, tool, params):
+    """
+    Creates the link object, registers and subscribes it
+
+    Link readiness is reported on its status topic as b"READY"
+    or b"FAILED" if the link couldn't be initialized
+    """
+    global failed_links
+
+    t0 = utime.ticks_us()
+    # run initialization routine for the tool type
+    # device errors (missing sensor, pin without interrupts) and invalid
+    # parameters fail the link only, other links are already working
+    try:
+        l = tool_verbs[tool][2](t, params)
+    except Exception as e:
+        print("ERROR: Link [", t, "] initialization fired exception", e)
+        l = None
+    if l == None:
+        print("ERROR: Could not initialize tool type [", tool, "] for link [", t, "]")
+        failed_links += 1
+        reports.append([t + b"/status", b"FAILED"])
+        return
+
+    # check mosfet groups
+    if tool == b"MOSFET" and l.group_id != mlc.NO_GROUP:
+        if l.group_id not in groups:
+            groups[l.group_id] = MosfetGroup(l.group_id)
+        g = groups[l.group_id]
+        g.pins.append(l.pin_id)
+        g.build_cycle()
+        l.group = g
+        if l.state == mlc.ON:
+            g.active += 1
+        if l.seq == mlc.SEQ:
+            g.seq = mlc.SEQ
+            # sequental group starts from its first mosfet
+            if g.next_pin == None:
+                g.next_pin = g.pins[0]
+
+    ml[t] = l
+    links.append(l)
+    dispatch[t] = [l, tool_verbs[tool][1]]
+    update_deadline(l)
+
+    # topics out of the controller namespace aren't covered by the wildcard
+    if not SUBSCRIBE_WILDCARD or not t.startswith(cname + b"/"):
+        mqtt_cli.subscribe(t)
+    print("Link", t, "is up in", utime.ticks_diff(utime.ticks_us(), t0), "us")
+    reports.append([l.status, b"READY"])
+
+
+
 def close_controller():
     """
     Closes controller and shut down mqtt connection
     """
 
+    pubq.drain(True)
     mqtt_cli.disconnect()
 
 
@@ -180,39 +440,206 @@ def close_controller():
 def run():
     """
     Executes application main cycle step
+
+    Only links which deadlines are reached are checked
     """
-    global check_time
-    global tool_verbs
-    global last_kar
-    global kat
+    t0 = utime.ticks_us()
 
-    if utime.ticks_ms() > check_time:
-        # check for mqtt messages
-        mqtt_cli.check_msg()
-        # check mqtt links states
-        for t, l in ml.items():
-            tool_verbs[l[0]][0](t, b"")
-        check_time = utime.ticks_ms() + CHECK_TIMEOUT
+    # reconnect and replay offline messages if needed
+    mqtt_cli.service()
 
-    if utime.ticks_ms() - last_kar > kat:
-        publish_status(b"STEADY" + b":{}".format(int(utime.ticks_ms()/1000)))
-        last_kar = utime.ticks_ms()
+    # check for mqtt messages
+    mqtt_cli.check_msg()
+
+    if len(pending) > 0 or len(reports) > 0:
+        bring_up()
+
+    check_events()
+    check_links()
+    keep_alive()
+    stream_links()
+
+    # publish queued messages
+    pubq.drain()
+
+    stats.run(t0)
 
     return True
 
 
 
-def reset(msg):
+def check_links():
+    """
+    Checks states of mqtt links which deadlines are reached
+    """
+    for t in sched.pop_due():
+        l = ml[t]
+        fn = tool_verbs[l.tool][0]
+        t0 = utime.ticks_us()
+        try:
+            fn(l)
+        except MemoryError:
+            out_of_memory(l)
+        stats.call(fn, t0)
+        update_deadline(l)
+
+
+
+def out_of_memory(link):
+    """
+    Releases emergency reserve and reports MemoryError
+    """
+    mem.emergency()
+    publish_status(b"ERROR: Out of memory", link)
+
+
+
+def check_events():
+    """
+    Processes pin events captured by interrupts
+
+    Returns True if there were any events
+    """
+    if events.overflow:
+        # some edges were lost, so recheck all the pins
+        events.overflow = False
+        for l in pin_links:
+            pin_edge(l, utime.ticks_ms())
+
+    return events.drain(pin_event) > 0
+
+
+
+def pin_event(sid, t):
+    """
+    Processes single pin event from the events ring
+    """
+    pin_edge(pin_links[sid], t)
+
+
+
+def pin_edge(link, t):
+    """
+    Starts or restarts link pin debouncing
+    """
+    link.bounce = t
+    link.settling = True
+    update_deadline(link)
+
+
+
+def watch_pin(link):
+    """
+    Sets interrupt handler on both edges of the link pin
+    """
+    sid = len(pin_links)
+    link.pin.irq(handler = lambda p: events.put(sid, utime.ticks_ms()),
+                 trigger = Pin.IRQ_RISING | Pin.IRQ_FALLING)
+    # the link is watched only if its interrupt is set
+    pin_links.append(link)
+
+
+
+def keep_alive():
+    """
+    Sends keep alive reply if its timeout is reached
+
+    Returns milliseconds left until the next reply
+    """
+    global last_kar
+
+    if utime.ticks_diff(utime.ticks_ms(), last_kar) > kat:
+        n = enc.put_bytes(ka_buf, 0, b"STEADY:")
+        n = enc.put_int(ka_buf, n, utime.ticks_ms() // 1000)
+        publish_status(ka_buf[:n], None, ka_buf)
+        if stats_steady:
+            publish_status(stats_report())
+        last_kar = utime.ticks_ms()
+
+    return max(0, kat - utime.ticks_diff(utime.ticks_ms(), last_kar))
+
+
+
+def update_deadline(link):
+    """
+    Reschedules the link check according to its current state
+    """
+    nxt = tool_verbs[link.tool][3]
+    if nxt == None:
+        return
+
+    dl = nxt(link)
+    if dl == None:
+        sched.cancel(link.topic)
+    else:
+        sched.schedule(link.topic, dl)
+
+
+
+def sleep_time():
+    """
+    Returns milliseconds the main cycle could sleep for
+    until the nearest link deadline or keep alive reply
+    """
+    if len(pending) > 0:
+        return 0
+
+    ka = kat - utime.ticks_diff(utime.ticks_ms(), last_kar)
+    t = max(0, min(CHECK_TIMEOUT, ka))
+    if pubq.busy() or len(reports) > 0 or links_job != None:
+        t = min(t, PUB_RETRY_TIMEOUT)
+    # pin interrupts don't break the waiting for mqtt messages
+    if len(pin_links) > 0:
+        t = min(t, EVENTS_CHECK_TIMEOUT)
+    t = mqtt_cli.time_left(t)
+
+    return sched.time_left(t)
+
+
+
+def idle():
+    """
+    Waits for the incoming mqtt message no longer than sleep_time()
+    """
+    global poller
+    global poller_sock
+
+    t = sleep_time()
+    if t == 0:
+        return
+
+    # idle gap is the best time for the garbage collection
+    t = mem.idle(t)
+    if t == 0:
+        return
+
+    if mqtt_cli.sock == None:
+        # session is offline, nothing to wait for
+        utime.sleep_ms(t)
+        return
+
+    # mqtt client could recreate its socket on reconnect
+    if poller_sock is not mqtt_cli.sock:
+        poller = uselect.poll()
+        poller.register(mqtt_cli.sock, uselect.POLLIN)
+        poller_sock = mqtt_cli.sock
+
+    poller.poll(t)
+
+
+
+def reset(link, arg):
     """
     Resets the board
     """
     publish_status(b"GOING RESET")
+    pubq.drain(True)
     from machine import reset
     reset()
 
 
 
-def get_sys_info(msg):
+def get_sys_info(link, arg):
     """
     Return the system information
     Name:uptime in seconds:keep alive timout in secondes
@@ -220,322 +647,1014 @@ def get_sys_info(msg):
     global cname
     global kat
 
-    publish_status(cname + b":{}:".format(int(utime.ticks_ms()/1000)) + b"{}".format(int(kat/1000)))
+    n = enc.put_bytes(sys_buf, 0, cname)
+    n = enc.put_byte(sys_buf, n, enc.COLON)
+    n = enc.put_int(sys_buf, n, utime.ticks_ms() // 1000)
+    n = enc.put_byte(sys_buf, n, enc.COLON)
+    n = enc.put_int(sys_buf, n, kat // 1000)
+    publish_status(sys_buf[:n], None, sys_buf)
 
 
 
-def get_mqtt_links(msg):
+def get_mqtt_links(link, arg):
     """
-    Returns the mqtt links registered on the device
-    
-    topic:tool_type:state
+    Publishes the mqtt links registered on the device by pages
+
+    get_links[:{filter}[:{cursor}]]
+    Filter is either a tool type or a topic prefix, empty filter matches
+    all links. Without cursor all pages are published one by one,
+    otherwise only the page which starts from the cursor.
+    Every page holds topic:tool_type:state lines and ends with
+    next:{cursor of the next page or -1}
     """
-    global ml
+    global links_job
 
-    mls = b""
-    for t, l in ml.items():
-        if l[0] == b"MOSFET":
-            mls += t + ":" + l[0] + ":" + on_off_str[l[2][1]] + "\n"
-        elif l[0] == b"SENSOR_I2C":
-            mls += t + ":" + l[0] + ":" + l[1][1] + ":" + l[1][2] + "\n"
-        else:
-            mls += t + ":" + l[0] + "\n"
+    flt = None
+    cursor = -1
+    if arg != None:
+        i = arg.find(b":")
+        if i != -1:
+            try:
+                cursor = int(arg[i+1:], 10)
+            except ValueError:
+                publish_status(b"ERROR: Invalid links cursor: " + arg[i+1:])
+                return
+            arg = arg[:i]
+        if len(arg) > 0:
+            flt = arg
 
-    publish_status(mls)
+    # the new request replaces the unfinished one
+    links_job = [flt, max(0, cursor), cursor != -1]
+    stream_links()
 
 
 
-def set_keep_alive_timeout(msg):
+def stream_links():
+    """
+    Publishes the next page of get_links output once the previous one
+    has left the publish queue, so all pages share the same buffer
+    """
+    global links_job
+    global links_page
+
+    if links_job == None or (links_page != None and pubq.queued(links_page)):
+        return
+
+    flt, cursor, single = links_job
+    n, cursor = put_links(links_buf, flt, cursor)
+    links_page = links_buf[:n]
+    publish_status(links_page)
+
+    if single or cursor == -1:
+        links_job = None
+    else:
+        links_job[1] = cursor
+
+
+
+def put_links(buf, flt, cursor):
+    """
+    Writes lines of links matching the filter from the cursor while
+    they fit into buf and the footer with the next cursor
+
+    Returns the page size and the next cursor or -1 if there are no more links
+    """
+    end = len(buf) - LINKS_FOOTER_SIZE
+    n = 0
+    ii = cursor
+    while ii < len(links):
+        l = links[ii]
+        if flt == None or l.tool == flt or l.topic.startswith(flt):
+            try:
+                p = put_link(buf, n, l)
+            except IndexError:
+                p = len(buf)
+            if p > end:
+                if n > 0:
+                    break
+                # the line longer than the page is cut to its topic
+                p = enc.put_bytes(buf, n, l.topic[:end - n - 1])
+                p = enc.put_byte(buf, p, enc.NEWLINE)
+            n = p
+        ii += 1
+
+    if ii >= len(links):
+        ii = -1
+    n = enc.put_bytes(buf, n, b"next:")
+    n = enc.put_int(buf, n, ii)
+
+    return n, ii
+
+
+
+def put_link(buf, pos, l):
+    """
+    Writes topic:tool_type:state line of the link
+    """
+    pos = enc.put_bytes(buf, pos, l.topic)
+    pos = enc.put_byte(buf, pos, enc.COLON)
+    pos = enc.put_bytes(buf, pos, l.tool)
+    if l.tool == b"MOSFET" or l.tool == b"SWITCH":
+        pos = enc.put_byte(buf, pos, enc.COLON)
+        pos = enc.put_bytes(buf, pos, on_off_str[l.state])
+    elif l.tool == b"BUTTON":
+        pos = enc.put_byte(buf, pos, enc.COLON)
+        pos = enc.put_bytes(buf, pos, on_off_str[int(l.pressed)])
+    elif l.tool == b"SENSOR_I2C":
+        pos = enc.put_byte(buf, pos, enc.COLON)
+        pos = enc.put_str(buf, pos, l.name)
+        pos = enc.put_byte(buf, pos, enc.COLON)
+        pos = enc.put_int(buf, pos, l.period)
+
+    return enc.put_byte(buf, pos, enc.NEWLINE)
+
+
+
+def get_stats(link, arg):
+    """
+    Publishes performance counters
+
+    stats:1 turns on publishing them with every keep alive reply,
+    stats:0 turns it off
+    """
+    global stats_steady
+
+    if arg != None:
+        stats_steady = arg != 0
+
+    publish_status(stats_report())
+
+
+
+def stats_report():
+    """
+    Returns performance counters followed by publishing, mqtt session,
+    I2C buses and memory manager counters
+
+    pub:{published}:{coalesced}:{dropped}
+    session:{buffered}:{replayed}:{dropped}:{reconnects}
+    i2c:{sda}/{scl}:{transactions}:{errors}
+    """
+    return stats.report() + "pub:{}:{}:{}\nsession:{}:{}:{}:{}\n".format(
+        pubq.published, pubq.coalesced, pubq.dropped, mqtt_cli.buffered,
+        mqtt_cli.replayed, mqtt_cli.dropped, mqtt_cli.reconnects).encode() + \
+        i2c_report() + mem.report()
+
+
+
+def i2c_report():
+    """
+    Returns transactions counters of I2C buses used by sensor links
+    """
+    buses = []
+    for l in ml.values():
+        if l.tool == b"SENSOR_I2C" and l.sensor.bus not in buses:
+            buses.append(l.sensor.bus)
+
+    r = b""
+    for bus in buses:
+        r += "i2c:{}/{}:{}:{}\n".format(bus.pins[0], bus.pins[1],
+                                       bus.transactions, bus.errors).encode()
+
+    return r
+
+
+
+def get_frag(link, arg):
+    """
+    Publishes heap fragmentation
+
+    frag:{free}:{largest free block}:{fragmentation percent}
+    """
+    publish_status(mem.frag())
+
+
+
+def set_keep_alive_timeout(link, tout):
     """
     Sets new keep alive reply timout
     """
     global kat
 
-    try:
-        kat = int(msg.split(b':')[1], 10)
-        publish_status(b"new_kat:" + b"{}".format(kat))
-        kat *= 1000
-    except Exception as e:
-        publish_status(b"ERROR: couldn't set net KAT due to {}".format(e))
+    kat = tout * 1000
+    publish_status("new_kat:{}".format(tout).encode())
 
 
 
-def do_mosfet(topic, verb = b""):
+def check_mosfet(mos):
+    """
+    Checks the mosfet state and if it's on, checks the timeout,
+    turn it off and send response about
     """
-    Checks the mosfet state and reacts on given verbs
+    if mos.pin.value() == mlc.ON and (mos.max_time != -1 and utime.ticks_diff(utime.ticks_ms(), mos.changed) >= mos.timeout*1000):
+        switch_mosfet(mos, mlc.OFF)
+        mosfet_reply(mos)
+        admit_mosfet(mos.group)
 
-    If verb is empty it just checks current state and if it's on,
-    checks the timeout, turn it off and send response about
+
+
+def mosfet_status(mos, arg):
     """
-    
-    global ml
+    Publishes the mosfet status with its maximum load time
+    """
+    mosfet_reply(mos, True)
+
 
-    mos = ml[topic]
-    publish = False
-    update = False
 
-    if verb == b"":
-        if mos[2][0].value() == mlc.ON and (mos[1][2] != -1 and utime.ticks_ms() - mos[2][2] > mos[2][3]*1000):
-            update = True
-            publish = True
+def mosfet_on(mos, tout):
+    """
+    Turns the mosfet on for the optional timeout
 
-    elif verb == b"?":
-        publish = True
+    If another member of the mosfet group is working or the mosfet isn't
+    the next one in a sequental group, the request is queued
+    """
+    if tout != None:
+        # Check current mosfet's state and working time
+        # calculate working time limit according to the current working time 
+        if mos.pin.value() == mlc.ON and mos.max_time != -1:
+            limit = mos.max_time - utime.ticks_diff(utime.ticks_ms(), mos.changed) // 1000
+        else:
+            limit = -1
+        if tout <= 0:
+            tout = -1
+        # set new timeout according to the current time limit
+        if limit != -1 and tout != -1 and limit < tout:
+            mos.timeout = limit
+        else:
+            mos.timeout = tout
 
-    elif verb.startswith(b"on"):
-        if verb.startswith(b"on:"):
-            try:
-                tout = int(verb.split(':')[1], 10)
-                # Check current mosfet's state and working time
-                # calculate working time limit according to the current working time 
-                if mos[2][0].value() == mlc.ON and mos[1][2] != -1:
-                    limit = mos[1][2] - int((utime.tick_ms() - mos[2][2])/1000)
-                else:
-                    limit = -1
-                if tout <= 0:
-                    tout = -1
-                # set new timeout according to the current time limit
-                if limit != -1 and tout != -1 and limit < tout:
-                    mos[2][3] = limit
-                else:
-                    mos[2][3] = tout
+    if mos.state == mlc.OFF:
+        g = mos.group
+        if g != None and len(g.pins) > 1 and \
+           (g.active > 0 or len(g.jobs) > 0 or (g.seq == mlc.SEQ and mos.pin_id != g.next_pin)):
+            queue_mosfet(mos)
+            return
+        switch_mosfet(mos, mlc.ON)
+    mosfet_reply(mos)
+
+
+
+def mosfet_off(mos, arg):
+    """
+    Turns the mosfet off or cancels its queued request
+    """
+    if mos.state == mlc.ON:
+        switch_mosfet(mos, mlc.OFF)
+        mosfet_reply(mos)
+        admit_mosfet(mos.group)
+        return
+
+    if mos.group != None and mos in mos.group.jobs:
+        mos.group.jobs.remove(mos)
+    mosfet_reply(mos)
 
-            except Exception as e:
-                publish_status(b"ERROR: Invalid timeout value in" + verb + b" fired exception {}".format(e), topic)
 
-        if mos[2][1] == mlc.OFF:
-            update = True
-        publish = True
 
-    elif verb == b"off":
-        if mos[2][1] == mlc.ON:
-            update = True
-        publish = True
+def queue_mosfet(mos):
+    """
+    Queues the mosfet start until its group is free
+
+    Replies b"queued:{position in the queue}"
+    """
+    g = mos.group
+    if mos not in g.jobs:
+        g.jobs.append(mos)
+
+    # idle sequental group starts the request at once
+    admit_mosfet(g)
+    if mos in g.jobs:
+        publish_status("queued:{}".format(g.jobs.index(mos) + 1).encode(), mos)
+
+
+
+def admit_mosfet(g):
+    """
+    Starts the next queued mosfet if its group is free
+
+    Sequental group keeps its order, members without queued requests
+    are skipped
+    """
+    if g == None or g.active > 0 or len(g.jobs) == 0:
+        return
+
+    mos = g.jobs[0]
+    if g.seq == mlc.SEQ:
+        p = g.next_pin
+        found = False
+        for ii in range(len(g.pins)):
+            for m in g.jobs:
+                if m.pin_id == p:
+                    mos = m
+                    found = True
+                    break
+            if found:
+                break
+            p = g.cycle[p]
+        g.next_pin = mos.pin_id
+
+    g.jobs.remove(mos)
+    switch_mosfet(mos, mlc.ON)
+    mosfet_reply(mos)
+    # admitted mosfet isn't the link which is being processed
+    update_deadline(mos)
+
+
+
+def mosfet_queue(mos, arg):
+    """
+    Publishes the queue of the mosfet group
+
+    b"{topic}:{timeout}" lines in the start order of a non-sequental group
+    """
+    g = mos.group
+    if g == None or len(g.jobs) == 0:
+        publish_status(b"", mos)
+        return
+
+    # the buffer grows up to the longest queue of the group
+    sz = 0
+    for m in g.jobs:
+        sz += len(m.topic) + QUEUE_LINE_SIZE
+    if g.buf == None or len(g.buf) < sz:
+        g.buf = bytearray(sz)
+
+    n = 0
+    for m in g.jobs:
+        n = enc.put_bytes(g.buf, n, m.topic)
+        n = enc.put_byte(g.buf, n, enc.COLON)
+        n = enc.put_int(g.buf, n, m.timeout)
+        n = enc.put_byte(g.buf, n, enc.NEWLINE)
+    publish_status(memoryview(g.buf)[:n], mos, g.buf)
+
+
+
+def mosfet_cancel(mos, arg):
+    """
+    Cancels the queued mosfet request
+    """
+    if mos.group == None or mos not in mos.group.jobs:
+        publish_status(b"ERROR: No queued request", mos)
+        return
 
+    mos.group.jobs.remove(mos)
+    publish_status(b"cancelled", mos)
+
+
+
+def switch_mosfet(mos, state):
+    """
+    Changes the mosfet state and keeps its group state
+    """
+    g = mos.group
+    prev = mos.state
+
+    if state == mlc.OFF:
+        mos.pin.off()
+        # update mosfet group if need be
+        if g != None and len(g.pins) > 1 and g.seq == mlc.SEQ:
+            # next mosfet in a sequence follows the one turned off
+            g.next_pin = g.cycle[mos.pin_id]
     else:
-        publish_status(b"ERROR: Invalid verb [" + verb + b"] in topic [" + topic + b"]")
-
-    if publish:
-        if update:
-            if mos[2][0].value() == mlc.ON:
-                mos[2][0].off()
-                # update mosfet group if need be
-                if len(mos[2][3][1]) > 1:
-                    if mos[2][3][0] == mlc.SEQ:
-                        # get current mosfet index in a group and increase it
-                        ii = mos[2][3][1].index(mos[2][3][2])
-                        ii += 1
-                        if ii > len(mos[2][3][1]) - 1:
-                            ii = 0
-                        mos[2][3][2] = mos[2][3][1][ii]
-            else:
-                # if the mosfet is in a group, check possibility to turn it on
-                if len(mos[2][3][1]) > 1: 
-                    if mos[2][3][0] == mlc.SEQ:
-                        # if it's a sequental group of mosfets, the mosfet pin should be equal 
-                        # to the next mosfet in a group id to be powered on
-                        if mos[1][0] == mos[2][3][2]:
-                            mos[2][0].on()
-                    else:
-                        # check if every group mosfet is off then turn it on
-                        found = False
-                        for l in ml.values():
-                            if l[0] == b"MOSFET":
-                                if l[1][0] != mos[1][0] and l[1][0] in mos[2][3][1] and l[2][0].value() == mlc.ON:
-                                    found = True
-                                    break
-                        if not found:
-                            mos[2][0].on()
-                        else:
-                            if verb == b"on":
-                                publish_status(b"WARNING: Could not start " + topic + b" due to group [{}] conflict".format(mos[1][3]))
-                else:
-                    mos[2][0].on()
-
-            mos[2][1] = mos[2][0].value()
-            mos[2][2] = utime.ticks_ms()
-        if mos[2][1] == mlc.ON:
-            reply = on_off_str[mos[2][1]] + b" {}/{}".format(int((utime.ticks_ms() - mos[2][2])/1000), mos[2][3])
+        # group conflicts are resolved by mosfet_on and admit_mosfet
+        mos.pin.on()
+
+    mos.state = mos.pin.value()
+    mos.changed = utime.ticks_ms()
+
+    # keep the number of active group members
+    if g != None and mos.state != prev:
+        if mos.state == mlc.ON:
+            g.active += 1
         else:
-            reply = on_off_str[mos[2][1]] + b" {}".format(int((utime.ticks_ms() - mos[2][2])/1000))
-        if verb == b"?":
-            reply += b":{}".format(mos[1][2])
-        publish_status(reply, topic)
+            g.active -= 1
 
 
 
-def do_switch(topic, verb = b""):
+def mosfet_reply(mos, full = False):
+    """
+    Publishes the mosfet state
+    
+    Maximum load time is added if full is True
+    """
+    b = mos.buf
+    if mos.fmt == mlc.BINARY:
+        n = mqtt_bin.put_header(b, mqtt_bin.MOSFET, utime.ticks_ms() // 1000, 4 if full else 3)
+        n = mqtt_bin.put_field(b, n, mlc.F_STATE, mos.state)
+        n = mqtt_bin.put_field(b, n, mlc.F_SINCE, utime.ticks_diff(utime.ticks_ms(), mos.changed) // 1000)
+        n = mqtt_bin.put_field(b, n, mlc.F_TIMEOUT, mos.timeout)
+        if full:
+            n = mqtt_bin.put_field(b, n, mlc.F_MAX_TIME, mos.max_time)
+        publish_status(mos.mv[:n], mos, mos.buf)
+        return
+
+    n = enc.put_bytes(b, 0, on_off_str[mos.state])
+    n = enc.put_byte(b, n, enc.SPACE)
+    n = enc.put_int(b, n, utime.ticks_diff(utime.ticks_ms(), mos.changed) // 1000)
+    if mos.state == mlc.ON:
+        n = enc.put_byte(b, n, enc.SLASH)
+        n = enc.put_int(b, n, mos.timeout)
+    if full:
+        n = enc.put_byte(b, n, enc.COLON)
+        n = enc.put_int(b, n, mos.max_time)
+    publish_status(mos.mv[:n], mos, mos.buf)
+
+
+
+def check_switch(sw):
     """
-    Checks the switch state on timeout and reacts on given verbs
+    Checks the switch state after debouncing and on timeout 
 
-    If verb is empty it just checks current state. 
-    if timeout is reached or the state is changed then publish the state on mqtt server
+    if timeout is reached or the state is changed then publish the state on mqtt server.
+    With heartbeat unchanged state is published on timeout only if heartbeat is reached
     """
+    now = utime.ticks_ms()
+    if sw.settling:
+        if utime.ticks_diff(now, sw.bounce) < DEBOUNCE_TIMEOUT:
+            return
+        sw.settling = False
+        if sw.pin.value() != sw.state:
+            switch_status(sw, None)
+            return
 
-    global ml
+    if sw.timeout != -1 and utime.ticks_diff(now, sw.checked) >= sw.timeout * 1000:
+        # unchanged state is published no more often than heartbeat
+        if sw.heartbeat == -1 or sw.pin.value() != sw.state or \
+           utime.ticks_diff(now, sw.reported) >= sw.heartbeat * 1000:
+            switch_status(sw, None)
+        else:
+            sw.checked = now
+
+
+
+def switch_status(sw, arg):
+    """
+    Publishes the switch state and time since it was changed
+    """
+    newVal = sw.pin.value()
+    sw.checked = utime.ticks_ms()
+    sw.reported = sw.checked
+    if newVal != sw.state: # update switch values if needed before publishing them
+        sw.state = newVal
+        sw.changed = sw.checked
+    publish_state(sw, mqtt_bin.SWITCH, sw.state, utime.ticks_diff(sw.checked, sw.changed) // 1000)
+
+
+
+def switch_timeout_get(sw, arg):
+    """
+    Publishes the switch check timeout
+    """
+    publish_status("{}".format(sw.timeout).encode(), sw)
 
-    sw = ml[topic]
-    publish = False
-    
-    newVal = sw[2][0].value()
-    if verb == b"":
-        if  newVal != sw[2][1] or (sw[1][1] != -1 and utime.ticks_ms() - sw[2][2] > sw[1][1] * 1000):
-            publish = True
-            
-    elif verb == b"?":
-        publish = True
-
-    elif verb == b"timeout_get":
-        publish_status(b"{}".format(sw[1][1]), topic)
-
-    elif verb.startswith("timeout_set:"):
-        try:
-            sw[1][1] = int(verb.split(':')[1], 10)
-            publish_status(b"{}".format(sw[1][1]), topic)
-            sw[2][2] = utime.ticks_ms()
 
-        except Exception as e:
-            publish_status(b"ERROR: Invalid timeout set command " + verb + b" fired exception {}".format(e), topic)
 
+def switch_timeout_set(sw, tout):
+    """
+    Sets new switch check timeout and resets the timer
+    """
+    sw.timeout = tout
+    publish_status("{}".format(sw.timeout).encode(), sw)
+    sw.checked = utime.ticks_ms()
+
+
+
+def check_sensor_i2c(sens):
+    """
+    Drives the sensor conversion
+
+    Requests the sensor result if timeout is reached. When the conversion
+    the link waits for is over, publishes its result on mqtt server.
+    The result could be collected by another link on the same sensor.
+    Results of the sampling link are added to its aggregation window
+    """
+    if sens.converting:
+        if not sens.sensor.poll():
+            return
+        sens.converting = False
+        if sens.sensor.failed:
+            sensor_i2c_failed(sens)
+        else:
+            sensor_i2c_result(sens)
+        if sens.agg == None:
+            return
+
+    if sens.failed:
+        return
+
+    if sens.agg != None:
+        sample_sensor_i2c(sens)
+    elif sens.period != -1 and utime.ticks_diff(utime.ticks_ms(), sens.updated) >= sens.period * 1000:
+        request_sensor_i2c(sens, False)
+
+
+
+def sample_sensor_i2c(sens):
+    """
+    Publishes the aggregate and starts new window if timeout is reached.
+    Starts the next sample if sampling period is reached
+
+    History of the sampling link keeps means of published windows,
+    so it covers as many periods as the history of other links
+    """
+    now = utime.ticks_ms()
+    if sens.period != -1 and utime.ticks_diff(now, sens.updated) >= sens.period * 1000:
+        if sens.agg.count > 0:
+            if sens.hist != None:
+                sens.hist.put(sens.agg.mean)
+            publish_aggregate(sens)
+            sens.agg.reset()
+        sens.updated = now
+
+    if not sens.converting and utime.ticks_diff(now, sens.sampled) >= sens.sample:
+        sens.sampled = now
+        sens.sensor.begin()
+        sens.converting = True
+
+
+
+def publish_aggregate(sens):
+    """
+    Publishes the aggregation window of the sensor
+    """
+    if sens.fmt == mlc.BINARY:
+        n = sens.agg.frame(sens.buf, utime.ticks_ms() // 1000)
+        publish_status(sens.mv[:n], sens, sens.buf)
     else:
-        publish_status(b"ERROR: Invalid verb [" + verb + b"] in topic [" + topic + b"]")
+        publish_status(sens.agg.text(), sens, sens.buf)
+
+
 
-    if publish:
-        if newVal != sw[2][1]: # update switch values if needed before publishing them
-            sw[2][1] = newVal
-            sw[2][2] = utime.ticks_ms()
-        publish_status(on_off_str[sw[2][1]] + b" {}".format(int((utime.ticks_ms() - sw[2][2])/1000)), topic)
+def request_sensor_i2c(sens, forced):
+    """
+    Reports the cached sensor result if it isn't older than link max_age,
+    otherwise joins the sensor conversion starting it if needed
+
+    Forced result is published even if it's unchanged
+    """
+    if sens.converting:
+        sens.forced = sens.forced or forced
+        return
 
+    sens.forced = forced
+    if sens.sensor.fresh(sens.max_age):
+        sensor_i2c_result(sens)
+    else:
+        sens.sensor.begin()
+        sens.converting = True
 
 
-def do_sensor_i2c(topic, verb = b""):
+
+def sensor_i2c_result(sens):
     """
-    Checks sensor value as needed and process verbs
+    Takes the sensor result the link waited for or served from the cache
 
-    If verb is empty it just checks current state. 
-    if timeout is reached then updates value and publish it on mqtt server
+    Sampling link adds it to the aggregation window and publishes
+    the window if the result is forced (b"?" on the empty window)
     """
+    sens.failed = False
+    if sens.agg == None:
+        report_sensor_i2c(sens)
+        return
+
+    sens.agg.add(sens.sensor)
+    if sens.forced:
+        sens.forced = False
+        publish_aggregate(sens)
 
-    global ml
 
-    sens = ml[topic]
-    publish = False
 
-    if verb == b"":
-        if sens[1][2] != -1 and utime.ticks_ms() - sens[2][2] > sens[1][2] * 1000:
-            publish = True
+def sensor_i2c_failed(sens):
+    """
+    Reports the failed sensor conversion the link waited for
 
-    elif verb == b"?":
-        publish = True
+    The link tries again on its next period or sample. After
+    SENSOR_MAX_FAILURES failures in a row it publishes b"FAILED" and
+    stops polling the sensor until b"?" gets the result
+    """
+    forced = sens.forced
+    sens.forced = False
+    if sens.agg == None:
+        sens.updated = utime.ticks_ms()
+    n = sens.sensor.failures
+    if n >= SENSOR_MAX_FAILURES and not sens.failed:
+        sens.failed = True
+        publish_status(b"FAILED", sens, sens.buf)
+    elif n < SENSOR_MAX_FAILURES or forced:
+        publish_status("ERROR: Sensor conversion failed {} times".format(n).encode(),
+                       sens, sens.buf)
 
-    elif verb == b"timeout_get":
-        publish_status(b"{}".format(sens[1][2]), topic)
 
-    elif verb.startswith("timeout_set:"):
-        try:
-            sens[1][1] = int(verb.split(':')[1], 10)
-            publish_status(b"{}".format(sens[1][2]), topic)
-            sens[2][2] = utime.ticks_ms()
 
-        except Exception as e:
-            publish_status(b"ERROR: Invalid timeout set command " + verb + b" fired exception {}".format(e), topic)
+def report_sensor_i2c(sens):
+    """
+    Publishes the last sensor result if it's forced or changed
 
+    The result is kept in the link history anyway
+    """
+    if sens.hist != None:
+        sens.hist.add(sens.sensor)
+    if sens.forced or sens.band == None or sensor_changed(sens):
+        publish_sensor_i2c(sens)
     else:
-        publish_status(b"ERROR: Invalid verb [" + verb + b"] in topic [" + topic + b"]")
+        sens.updated = utime.ticks_ms()
+    sens.forced = False
 
-    if publish:
-        sens[2][1] = sens[2][0].get_value(True)
-        sens[2][2] = utime.ticks_ms()
-        publish_status(sens[2][1], topic)
 
 
+def sensor_changed(sens):
+    """
+    Returns True if any field of the last sensor result is out of its
+    deadband around the last reported value or heartbeat is reached
+    """
+    if sens.reported == None:
+        return True
 
-def do_button(topic, verb = b""):
-    print("do_button isn't implemented yet")
+    s = sens.sensor
+    for ii in range(len(sens.reported)):
+        if abs(s.fixed(ii) - sens.reported[ii]) > sens.limit[ii]:
+            return True
 
+    return sens.heartbeat != -1 and \
+           utime.ticks_diff(utime.ticks_ms(), sens.reported_at) >= sens.heartbeat * 1000
 
 
-def init_mosfet(mos):
+
+def publish_sensor_i2c(sens):
     """
-    Init single mosfet and create necessary run-time objects and data
+    Publishes the last sensor result
     """
-    p = Pin(mos[1][0], Pin.OUT)
-    if mos[1][1] == mlc.ON:
-        p.on()
+    sens.updated = utime.ticks_ms()
+    if sens.band != None:
+        remember_sensor_i2c(sens)
+    if sens.fmt == mlc.BINARY:
+        publish_status(sensor_frame(sens), sens, sens.buf)
     else:
-        p.off()
-    # Pin should be the first item in the run-time objects
-    mos[2].insert(0, p)         
-    # Mosfet current state should be the second item
-    mos[2].insert(1, p.value())
-    # Mosfet status change time should be the third item
-    mos[2].insert(2, utime.ticks_ms())
-    # Current mosfet timeout is placed as forth item
-    mos[2].insert(3, mos[1][2])
+        sens.value = sens.sensor.get_value()
+        publish_status(sens.value, sens, sens.buf)
 
 
-    return True
+
+def remember_sensor_i2c(sens):
+    """
+    Keeps the published sensor result and its deadband limits
+
+    Relative deadband is turned into the absolute limit here,
+    so sensor_changed compares integers only
+    """
+    s = sens.sensor
+    if sens.reported == None:
+        sens.reported = array("l", [0] * len(s.FIELDS))
+        sens.limit = array("l", [0] * len(s.FIELDS))
+
+    sens.reported_at = sens.updated
+    for ii in range(len(s.FIELDS)):
+        v = s.fixed(ii)
+        sens.reported[ii] = v
+        lim = sens.band[ii]
+        rel = field_opt(sens.deadband_rel, ii)
+        if rel != None:
+            lim = max(lim, int(abs(v) * rel))
+        sens.limit[ii] = lim
 
 
 
-def init_switch(sw):
+def field_opt(opt, i):
     """
-    Init single switch and create necessary run-time objects and data
+    Returns the option value for i-th sensor field,
+    option is either a single value for all fields or a tuple of them
     """
-    p = Pin(sw[1][0], Pin.IN)
-    # Pin should be the first item in the run-time objects
-    sw[2].insert(0, p)
-    # Current state should be second item
-    sw[2].insert(1, p.value())
-    # Checked time should be third item
-    sw[2].insert(2, utime.ticks_ms())
+    if isinstance(opt, tuple):
+        return opt[i]
 
-    return True
+    return opt
 
 
 
-def init_sensor_i2c(sI2c):
+def sensor_i2c_status(sens, arg):
     """
-    Init single I2C sensor and create necessary run-time objects and data
+    Requests the sensor value
+
+    Fresh cached value is published at once, otherwise it will be
+    published by check_sensor_i2c once conversion is over.
+    Sampling link publishes its current aggregation window if it has samples
+    """
+    if sens.agg != None and sens.agg.count > 0:
+        publish_aggregate(sens)
+    else:
+        request_sensor_i2c(sens, True)
+
+
+
+def sensor_i2c_history(sens, n):
+    """
+    Publishes the newest n sensor results of the link history
+    or all of them if n isn't given
+    """
+    if sens.hist == None:
+        publish_status(b"ERROR: Sensor history is off", sens)
+        return
+
+    # history isn't a state reply, so it's never replaced by readings
+    if sens.fmt == mlc.BINARY:
+        sz = sens.hist.frame(utime.ticks_ms() // 1000, n)
+    else:
+        sz = sens.hist.text(n)
+    publish_status(memoryview(sens.hist.buf)[:sz], sens, sens.hist.buf)
+
+
+
+def sensor_frame(sens):
+    """
+    Writes the last sensor result as binary frame into the link buffer
+    """
+    s = sens.sensor
+    n = mqtt_bin.put_header(sens.buf, mqtt_bin.SENSOR, utime.ticks_ms() // 1000, len(s.FIELDS))
+    for ii in range(len(s.FIELDS)):
+        n = mqtt_bin.put_field(sens.buf, n, s.FIELDS[ii], s.fixed(ii))
+
+    return sens.mv[:n]
+
+
+
+def sensor_i2c_timeout_get(sens, arg):
+    """
+    Publishes the sensor update timeout
+    """
+    publish_status("{}".format(sens.period).encode(), sens)
+
+
+
+def sensor_i2c_timeout_set(sens, tout):
+    """
+    Sets new sensor update timeout and resets the timer
+    """
+    sens.period = tout
+    publish_status("{}".format(sens.period).encode(), sens)
+    sens.updated = utime.ticks_ms()
+
+
+
+def check_button(butt):
+    """
+    Checks the button state after debouncing and reports
+    press, release and long press events
+    """
+    now = utime.ticks_ms()
+    if butt.settling:
+        if utime.ticks_diff(now, butt.bounce) < DEBOUNCE_TIMEOUT:
+            return
+        butt.settling = False
+        pressed = butt.pin.value() == butt.active
+        if pressed != butt.pressed:
+            butt.pressed = pressed
+            butt.changed = now
+            butt.long_sent = False
+            if pressed:
+                publish_status(b"press", butt)
+            else:
+                publish_status(b"release", butt)
+
+    if butt.pressed and not butt.long_sent and utime.ticks_diff(now, butt.changed) >= LONG_PRESS_TIMEOUT:
+        butt.long_sent = True
+        publish_status(b"long_press", butt)
+
+
+
+def button_status(butt, arg):
+    """
+    Publishes the button state and time since it was changed
+    """
+    publish_state(butt, mqtt_bin.BUTTON, int(butt.pressed), utime.ticks_diff(utime.ticks_ms(), butt.changed) // 1000)
+
+
+
+def publish_state(link, kind, state, since):
+    """
+    Publishes on/off state and seconds since it was changed
+    in the link payload format
+    """
+    b = link.buf
+    if link.fmt == mlc.BINARY:
+        n = mqtt_bin.put_header(b, kind, utime.ticks_ms() // 1000, 2)
+        n = mqtt_bin.put_field(b, n, mlc.F_STATE, state)
+        n = mqtt_bin.put_field(b, n, mlc.F_SINCE, since)
+    else:
+        n = enc.put_bytes(b, 0, on_off_str[state])
+        n = enc.put_byte(b, n, enc.SPACE)
+        n = enc.put_int(b, n, since)
+    publish_status(link.mv[:n], link, link.buf)
+
+
+
+def next_mosfet(mos):
+    """
+    Returns milliseconds left until the working mosfet should be turned off
+    """
+    if mos.state == mlc.ON and mos.max_time != -1:
+        return max(0, mos.timeout*1000 - utime.ticks_diff(utime.ticks_ms(), mos.changed))
+
+    return None
+
+
+
+def next_switch(sw):
+    """
+    Returns milliseconds left until the switch debouncing is over
+    or its timeout is reached
+    """
+    if sw.settling:
+        return max(0, DEBOUNCE_TIMEOUT - utime.ticks_diff(utime.ticks_ms(), sw.bounce))
+
+    if sw.timeout == -1:
+        return None
+
+    return max(0, sw.timeout*1000 - utime.ticks_diff(utime.ticks_ms(), sw.checked))
+
+
+
+def next_button(butt):
+    """
+    Returns milliseconds left until the button debouncing is over
+    or long press should be reported
+    """
+    if butt.settling:
+        return max(0, DEBOUNCE_TIMEOUT - utime.ticks_diff(utime.ticks_ms(), butt.bounce))
+
+    if butt.pressed and not butt.long_sent:
+        return max(0, LONG_PRESS_TIMEOUT - utime.ticks_diff(utime.ticks_ms(), butt.changed))
+
+    return None
+
+
+
+def next_sensor_i2c(sens):
+    """
+    Returns milliseconds left until the sensor update, sample
+    or its conversion result is ready
+    """
+    if sens.converting:
+        return max(0, utime.ticks_diff(sens.sensor.ready, utime.ticks_ms()))
+
+    if sens.failed:
+        return None
+
+    if sens.agg != None:
+        t = max(0, sens.sample - utime.ticks_diff(utime.ticks_ms(), sens.sampled))
+        if sens.period != -1:
+            t = min(t, max(0, sens.period*1000 - utime.ticks_diff(utime.ticks_ms(), sens.updated)))
+        return t
+
+    if sens.period == -1:
+        return None
+
+    return max(0, sens.period*1000 - utime.ticks_diff(utime.ticks_ms(), sens.updated))
+
+
+
+def init_mosfet(topic, params):
+    """
+    Creates single mosfet link and its run-time objects
+    """
+    mos = MosfetLink(topic, params)
+    mos.pin = Pin(mos.pin_id, Pin.OUT)
+    if mos.init_state == mlc.ON:
+        mos.pin.on()
+    else:
+        mos.pin.off()
+    mos.state = mos.pin.value()
+    mos.changed = utime.ticks_ms()
+
+    return mos
+
+
+
+def init_switch(topic, params):
+    """
+    Creates single switch link and its run-time objects
+    """
+    sw = SwitchLink(topic, params)
+    sw.pin = Pin(sw.pin_id, Pin.IN)
+    sw.state = sw.pin.value()
+    sw.changed = utime.ticks_ms()
+    sw.checked = sw.changed
+    sw.reported = sw.changed
+    watch_pin(sw)
+
+    return sw
+
+
+
+def init_sensor_i2c(topic, params):
+    """
+    Creates single I2C sensor link and its sensor controller
     """
     from sensors.sens_cont import SensorController
     from sensors.i2c import get_sensor
-    s = get_sensor(sI2c[1][0][0], sI2c[1][0][1], sI2c[1][1])
+
+    sens = I2CSensorLink(topic, params)
+    s = get_sensor(sens.bus[0], sens.bus[1], sens.name, sens.opts)
     if s == None:
-        print("FATAL: Couldn't init sensor", sI2c[1][1], "on I2C bus", sI2c[1][0])
-        return False
+        print("FATAL: Couldn't init sensor", sens.name, "on I2C bus", sens.bus)
+        return None
 
     if s.status != SensorController.OK:
         print("FATAL: Created sensor isn't OK")
-        return False
+        return None
 
-    sI2c[2].insert(0, s) # first item is sensor
-    sI2c[2].insert(1, b"") # second item is the current value of the sensor
-    sI2c[2].insert(2, utime.ticks_ms()) # third item is the last update time
+    sens.sensor = s
+    sens.updated = utime.ticks_ms()
 
-    return True
+    if sens.deadband != None or sens.deadband_rel != None or sens.heartbeat != -1:
+        init_deadband(sens)
 
+    if sens.history > 0:
+        sens.hist = History(s.FIELDS, sens.history)
 
+    if sens.sample > 0:
+        sens.agg = Aggregate(s.FIELDS)
+        # aggregate frame could be longer than the default reply buffer
+        if sens.fmt == mlc.BINARY and sens.agg.frame_size() > len(sens.buf):
+            sens.buf = bytearray(sens.agg.frame_size())
+            sens.mv = memoryview(sens.buf)
 
-def init_button(butt):
+    return sens
+
+
+
+def init_deadband(sens):
     """
-    Init single button and create necessary run-time objects and data
+    Turns on report on change for the sensor link
+
+    Result is published on timeout only if any field is changed by more than
+    "deadband" (in field units, e.g. 0.5 for C) or "deadband_rel" (fraction
+    of the last reported value, e.g. 0.01) since the last publication,
+    or "heartbeat" seconds have passed. Every option is either a single
+    value for all sensor fields or a tuple of values by fields.
+    Heartbeat without deadbands publishes any change of the result.
+    Tuple of the wrong length raises ValueError, so the link fails
+    on bring-up rather than on the first report
     """
-    return True
+    s = sens.sensor
+    for opt in (sens.deadband, sens.deadband_rel):
+        if isinstance(opt, tuple) and len(opt) != len(s.FIELDS):
+            raise ValueError("deadband tuple should have {} values".format(len(s.FIELDS)))
+
+    sens.band = array("l", [0] * len(s.FIELDS))
+    for ii in range(len(s.FIELDS)):
+        d = field_opt(sens.deadband, ii)
+        if d != None:
+            sens.band[ii] = int(d * mqtt_bin.fields.get(s.FIELDS[ii], ("", 1))[1])
 
 
 
-def publish_status(msg, topic = None):
+def init_button(topic, params):
     """
-    Publish status on the mqtt server
+    Creates single button link and its run-time objects
     """
-    global cname
+    butt = ButtonLink(topic, params)
+    if butt.pull == b"UP":
+        butt.pin = Pin(butt.pin_id, Pin.IN, Pin.PULL_UP)
+    elif butt.pull == b"DOWN" and hasattr(Pin, "PULL_DOWN"):
+        butt.pin = Pin(butt.pin_id, Pin.IN, Pin.PULL_DOWN)
+    else:
+        # ESP8266 has no internal pull down resistors, so it should be external
+        butt.pin = Pin(butt.pin_id, Pin.IN)
+    butt.pressed = butt.pin.value() == butt.active
+    butt.changed = utime.ticks_ms()
+    watch_pin(butt)
+
+    return butt
+
+
+
+def publish_status(msg, link = None, kind = None):
+    """
+    Queues status for publishing on the link status topic or
+    on the controller status topic if link is None
+
+    If kind is given, the status could be superseded by the newer one
+    of the same kind on the same topic until it's published. Replies
+    written into reply buffers should always be queued with their buffer
+    as the kind, so the buffer isn't reused while its previous content
+    is still queued and replies of different kinds don't replace each other.
+    Link state replies are queued with the link buffer as the kind
+    """
+    if isinstance(msg, bytes) and msg.startswith(b"ERROR"):
+        stats.errors += 1
 
-    if topic == None:
-        topic = cname
-    t = topic + b"/status"
-    print("<== Message [", msg, "] published on topic", t)
-    mqtt_cli.publish(t, msg)
+    if link == None:
+        pubq.put(cstatus, msg, kind)
+    else:
+        pubq.put(link.status, msg, kind)
+
+
+
+def publish(topic, msg):
+    """
+    Publish message on the mqtt server
+    """
+    print("<== Message [", msg, "] published on topic", topic)
+    mqtt_cli.publish(topic, msg)
 
 
 
@@ -543,17 +1662,31 @@ def publish_status(msg, topic = None):
 # Module initialization
 #------------------------------------------------------------------------------
 if __name__ != "__main__":
-    sys_verbs = dict()
-    sys_verbs[b"?"] = get_sys_info
-    sys_verbs[b"reset"] = reset
-    sys_verbs[b"get_links"] = get_mqtt_links
-    sys_verbs[b"set_kat"] = set_keep_alive_timeout
-
-    tool_verbs[b"MOSFET"][0] = do_mosfet
-    tool_verbs[b"MOSFET"][2] = init_mosfet
-    tool_verbs[b"SWITCH"][0] = do_switch
-    tool_verbs[b"SWITCH"][2] = init_switch
-    tool_verbs[b"SENSOR_I2C"][0] = do_sensor_i2c
-    tool_verbs[b"SENSOR_I2C"][2] = init_sensor_i2c
-    tool_verbs[b"BUTTON"][0] = do_button
-    tool_verbs[b"BUTTON"][2] = init_button
+    sys_verbs[b"?"]         = [get_sys_info, ARG_NO]
+    sys_verbs[b"reset"]     = [reset, ARG_NO]
+    sys_verbs[b"get_links"] = [get_mqtt_links, ARG_STR]
+    sys_verbs[b"set_kat"]   = [set_keep_alive_timeout, ARG_INT]
+    sys_verbs[b"stats"]     = [get_stats, ARG_OPT]
+    sys_verbs[b"frag"]      = [get_frag, ARG_NO]
+
+    tool_verbs[b"MOSFET"] = [check_mosfet,
+                             {b"?"  : [mosfet_status, ARG_NO],
+                              b"on" : [mosfet_on, ARG_OPT],
+                              b"off": [mosfet_off, ARG_NO],
+                              b"queue" : [mosfet_queue, ARG_NO],
+                              b"cancel": [mosfet_cancel, ARG_NO]},
+                             init_mosfet, next_mosfet]
+    tool_verbs[b"SWITCH"] = [check_switch,
+                             {b"?"          : [switch_status, ARG_NO],
+                              b"timeout_get": [switch_timeout_get, ARG_NO],
+                              b"timeout_set": [switch_timeout_set, ARG_INT]},
+                             init_switch, next_switch]
+    tool_verbs[b"SENSOR_I2C"] = [check_sensor_i2c,
+                                 {b"?"          : [sensor_i2c_status, ARG_NO],
+                                  b"timeout_get": [sensor_i2c_timeout_get, ARG_NO],
+                                  b"timeout_set": [sensor_i2c_timeout_set, ARG_INT],
+                                  b"history"    : [sensor_i2c_history, ARG_OPT]},
+                                 init_sensor_i2c, next_sensor_i2c]
+    tool_verbs[b"BUTTON"] = [check_button,
+                             {b"?": [button_status, ARG_NO]},
+                             init_button, next_button]
@@ -0,0 +1,161 @@
+"""
+Asynchronous runtime for mqtt links controller
+
+Runs mqtt messages receiving, links checking, keep alive replies
+and publishing as separate tasks instead of the mqtt_link.run() cycle.
+Uses uasyncio on the device and asyncio on the host.
+
+Controller should be initialized by mqtt_link.init_controller first
+
+(c) Dr. Dobermann, 2018.
+"""
+
+try:
+    import uasyncio as asyncio
+except ImportError:
+    import asyncio
+
+import utime
+import uselect
+
+import mqtt_link
+
+# Constants
+#------------------------------------------------------------------------------
+RECV_TIMEOUT = 50 # milliseconds
+RECV_BATCH = 16   # messages received in a row before other tasks run
+
+
+# Gloabal variables
+#------------------------------------------------------------------------------
+# event wakes up links checker when mqtt message could change link deadlines
+wake = None
+
+# poller for incoming mqtt messages and the socket it's registered for
+poller = None
+poller_sock = None
+
+
+# Functions
+#------------------------------------------------------------------------------
+def cb(topic, msg):
+    """
+    MQTT call back processor
+
+    Processes message with mqtt_link.cb and wakes up links checker
+    """
+    mqtt_link.cb(topic, msg)
+    wake.set()
+
+
+
+def readable():
+    """
+    Returns True if there is incoming data on the mqtt socket
+    """
+    global poller
+    global poller_sock
+
+    sock = mqtt_link.mqtt_cli.sock
+    if sock == None:
+        return False
+
+    # mqtt client could recreate its socket on reconnect
+    if poller_sock is not sock:
+        poller = uselect.poll()
+        poller.register(sock, uselect.POLLIN)
+        poller_sock = sock
+
+    return len(poller.poll(0)) > 0
+
+
+
+async def receiver():
+    """
+    Keeps mqtt session, checks for incoming mqtt messages and pin events
+
+    All the messages which are already received are processed in a row,
+    up to RECV_BATCH of them
+    """
+    while True:
+        mqtt_link.mqtt_cli.service()
+        n = 0
+        while n < RECV_BATCH and readable():
+            mqtt_link.mqtt_cli.check_msg()
+            n += 1
+        # pin interrupts could not wake up the links checker by themselves
+        if mqtt_link.check_events():
+            wake.set()
+        if n == RECV_BATCH:
+            # more messages could be waiting, but let other tasks run
+            await asyncio.sleep(0)
+        else:
+            await asyncio.sleep(RECV_TIMEOUT / 1000)
+
+
+
+async def publisher():
+    """
+    Publishes queued messages
+    """
+    while True:
+        mqtt_link.pubq.drain()
+        await asyncio.sleep(mqtt_link.PUB_RETRY_TIMEOUT / 1000)
+
+
+
+async def links_checker():
+    """
+    Brings up pending links and checks links when their deadlines are reached.
+    Sensor conversions are driven here as well since their results
+    are scheduled as link deadlines. get_links pages are streamed here too
+    """
+    while True:
+        t0 = utime.ticks_us()
+        if len(mqtt_link.pending) > 0 or len(mqtt_link.reports) > 0:
+            mqtt_link.bring_up()
+        mqtt_link.check_links()
+        mqtt_link.stream_links()
+        mqtt_link.stats.run(t0)
+        t = mqtt_link.sched.time_left(mqtt_link.CHECK_TIMEOUT)
+        if len(mqtt_link.pending) > 0:
+            # let other tasks run between bring-up slices
+            t = 0
+        elif len(mqtt_link.reports) > 0 or mqtt_link.links_job != None:
+            t = min(t, mqtt_link.PUB_RETRY_TIMEOUT)
+        # idle gap is the best time for the garbage collection
+        t = mqtt_link.mem.idle(t)
+        wake.clear()
+        try:
+            await asyncio.wait_for(wake.wait(), t / 1000)
+        except asyncio.TimeoutError:
+            pass
+
+
+
+async def keep_alive():
+    """
+    Sends keep alive replies
+    """
+    while True:
+        t = mqtt_link.keep_alive()
+        # keep alive timeout could be changed by set_kat verb
+        await asyncio.sleep(min(t, mqtt_link.CHECK_TIMEOUT) / 1000)
+
+
+
+async def main():
+    global wake
+
+    wake = asyncio.Event()
+    mqtt_link.mqtt_cli.set_callback(cb)
+
+    await asyncio.gather(receiver(), links_checker(), keep_alive(), publisher())
+
+
+
+def run():
+    """
+    Runs controller tasks until the controller is stopped
+    """
+    asyncio.run(main())
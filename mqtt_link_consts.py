@@ -9,4 +9,18 @@ OFF = 0
 NO_GROUP = -1
 
 SEQ = True
-NO_SEQ = False
\ No newline at end of file
+NO_SEQ = False
+
+# payload formats
+TEXT = 0
+BINARY = 1
+
+# binary payload field types
+# sensor values are fixed point with two decimal digits
+F_TEMP     = 1 # 0.01 C
+F_PRESSURE = 2 # 0.01 Pa
+F_RHUM     = 3 # 0.01 %
+F_STATE    = 4 # ON or OFF
+F_SINCE    = 5 # seconds since state change
+F_TIMEOUT  = 6 # seconds
+F_MAX_TIME = 7 # seconds
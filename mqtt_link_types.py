@@ -0,0 +1,246 @@
+"""
+MQTT link objects
+
+Every link from mqtt_links dictionary is turned into an object with fixed
+fields which holds both tool type parameters and run-time data
+
+(c) Dr. Dobermann, 2018.
+"""
+
+import mqtt_link_consts as mlc
+
+# size of the link reply buffer
+REPLY_BUF_SIZE = 48
+# default age in milliseconds of the sensor result served without conversion
+SENSOR_MAX_AGE = 1000
+# default number of sensor results kept in the link history
+SENSOR_HISTORY = 32
+
+
+class Link():
+    """
+    Base class for all mqtt links
+
+    Link keeps its status topic and the buffer for state replies
+    created once on initialization.
+    Optional last tool type parameter sets the payload format
+    for state replies, mlc.TEXT or mlc.BINARY
+    """
+    __slots__ = ("topic", "tool", "status", "buf", "mv", "fmt")
+
+    def __init__(self, topic, tool, params, nparams):
+        self.topic = topic
+        self.tool = tool
+        if len(params) > nparams:
+            self.fmt = params[nparams]
+        else:
+            self.fmt = mlc.TEXT
+        self.status = topic + b"/status"
+        self.buf = bytearray(REPLY_BUF_SIZE)
+        self.mv = memoryview(self.buf)
+#------------------------------------------------------------------------------
+
+
+
+class MosfetGroup():
+    """
+    Group of mosfets which couldn't be powered on simultaneously
+    """
+    __slots__ = ("gid", "seq", "pins", "next_pin", "cycle", "active", "jobs", "buf")
+
+    def __init__(self, gid):
+        self.gid = gid
+        self.seq = mlc.NO_SEQ
+        # pin numbers of group mosfets
+        self.pins = []
+        # pin of the next mosfet to power on in a sequental group
+        self.next_pin = None
+        # next pin in a sequence for every group pin
+        self.cycle = dict()
+        # number of powered on group mosfets
+        self.active = 0
+        # MosfetLinks waiting for the group to be free in the request order
+        self.jobs = []
+        # queue reply buffer, it's allocated on the first request
+        self.buf = None
+
+    def build_cycle(self):
+        """
+        Precomputes the sequence of group pins
+        """
+        self.cycle.clear()
+        for ii in range(len(self.pins)):
+            self.cycle[self.pins[ii]] = self.pins[(ii + 1) % len(self.pins)]
+#------------------------------------------------------------------------------
+
+
+
+class MosfetLink(Link):
+    """
+    MOSFET link
+
+    params: [pin id, initial state, max load time, group id, sequence flag, (format)]
+    """
+    __slots__ = ("pin_id", "init_state", "max_time", "group_id", "seq",
+                 "pin", "state", "changed", "timeout", "group")
+
+    def __init__(self, topic, params):
+        Link.__init__(self, topic, b"MOSFET", params, 5)
+        self.pin_id = params[0]
+        self.init_state = params[1]
+        self.max_time = params[2]
+        self.group_id = params[3]
+        self.seq = params[4]
+
+        self.pin = None
+        self.state = mlc.OFF
+        # status change time
+        self.changed = 0
+        # current load time
+        self.timeout = self.max_time
+        # MosfetGroup or None if the mosfet isn't in any group
+        self.group = None
+#------------------------------------------------------------------------------
+
+
+
+class SwitchLink(Link):
+    """
+    SWITCH link
+
+    params: [pin id, check timeout, (format), (options)]
+
+    "heartbeat" option is the longest time in seconds between publications
+    of unchanged state, the state is checked on timeout still.
+    -1 (default) publishes the state on every timeout
+    """
+    __slots__ = ("pin_id", "timeout", "heartbeat", "pin", "state", "changed",
+                 "checked", "reported", "bounce", "settling")
+
+    def __init__(self, topic, params):
+        Link.__init__(self, topic, b"SWITCH", params, 2)
+        self.pin_id = params[0]
+        self.timeout = params[1]
+        self.heartbeat = -1
+        if len(params) > 3:
+            self.heartbeat = params[3].get("heartbeat", -1)
+
+        self.pin = None
+        self.state = mlc.OFF
+        # status change time
+        self.changed = 0
+        # last check time
+        self.checked = 0
+        # last published time
+        self.reported = 0
+        # last pin edge time
+        self.bounce = 0
+        # True until pin is stable for debounce time after the last edge
+        self.settling = False
+#------------------------------------------------------------------------------
+
+
+
+class I2CSensorLink(Link):
+    """
+    SENSOR_I2C link
+
+    params: [(sda pin, scl pin), sensor name, update period, (format), (driver options)]
+
+    Some items of driver options are taken by the link itself:
+    "max_age" is the age in milliseconds of the sensor result which could
+    be served without a new conversion,
+    "sample" is the sampling period in milliseconds, if it's set, sensor
+    results are aggregated and only the aggregate is published every period,
+    "deadband", "deadband_rel" and "heartbeat" turn on report on change
+    (see init_deadband),
+    "history" is the number of sensor results kept by the link, 0 turns
+    the history off
+    """
+    __slots__ = ("bus", "name", "period", "opts", "max_age", "sample",
+                 "deadband", "deadband_rel", "heartbeat", "sensor", "value",
+                 "updated", "converting", "forced", "agg", "sampled",
+                 "band", "reported", "limit", "reported_at", "history", "hist",
+                 "failed")
+
+    def __init__(self, topic, params):
+        Link.__init__(self, topic, b"SENSOR_I2C", params, 3)
+        self.bus = params[0]
+        self.name = params[1]
+        self.period = params[2]
+        # dictionary of sensor driver arguments
+        self.max_age = SENSOR_MAX_AGE
+        self.sample = 0
+        self.deadband = None
+        self.deadband_rel = None
+        self.heartbeat = -1
+        self.history = SENSOR_HISTORY
+        self.opts = None
+        if len(params) > 4:
+            # link options are removed from driver options
+            self.opts = dict(params[4])
+            self.max_age = self.opts.pop("max_age", SENSOR_MAX_AGE)
+            self.sample = self.opts.pop("sample", 0)
+            self.deadband = self.opts.pop("deadband", None)
+            self.deadband_rel = self.opts.pop("deadband_rel", None)
+            self.heartbeat = self.opts.pop("heartbeat", -1)
+            self.history = self.opts.pop("history", SENSOR_HISTORY)
+
+        self.sensor = None
+        # last sensor value
+        self.value = b""
+        # last update time
+        self.updated = 0
+        # True while the link waits for the sensor conversion result
+        self.converting = False
+        # True if the awaited result should be published even if it's unchanged
+        self.forced = False
+        # mqtt_agg.Aggregate window if the link samples the sensor
+        self.agg = None
+        # last sample time
+        self.sampled = 0
+        # report on change: absolute deadband, last reported values and
+        # their deadband limits by fields as fixed point arrays or None
+        self.band = None
+        self.reported = None
+        self.limit = None
+        # last publication time
+        self.reported_at = 0
+        # mqtt_hist.History of sensor results or None
+        self.hist = None
+        # True if the link stopped polling the sensor after failures
+        self.failed = False
+#------------------------------------------------------------------------------
+
+
+
+class ButtonLink(Link):
+    """
+    BUTTON link
+
+    params: [pin id, b"UP" or b"DOWN" pull mode, (format)]
+    """
+    __slots__ = ("pin_id", "pull", "pin", "active", "pressed", "changed",
+                 "long_sent", "bounce", "settling")
+
+    def __init__(self, topic, params):
+        Link.__init__(self, topic, b"BUTTON", params, 2)
+        self.pin_id = params[0]
+        self.pull = params[1]
+
+        self.pin = None
+        # pin value of the pressed button
+        if self.pull == b"UP":
+            self.active = 0
+        else:
+            self.active = 1
+        self.pressed = False
+        # press or release time
+        self.changed = 0
+        # True if long press is already reported for the current press
+        self.long_sent = False
+        # last pin edge time
+        self.bounce = 0
+        # True until pin is stable for debounce time after the last edge
+        self.settling = False
+#------------------------------------------------------------------------------
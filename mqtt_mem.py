@@ -0,0 +1,127 @@
+"""
+Memory manager
+
+Runs garbage collection in idle gaps of the main cycle instead of random
+allocation points, keeps emergency reserve for MemoryError handling and
+measures heap fragmentation
+
+(c) Dr. Dobermann, 2018.
+"""
+
+import gc
+import micropython
+import utime
+
+
+class Memory():
+    """
+    Heap manager
+
+    Should be created at startup before the heap is fragmented.
+    reserve bytes are allocated at once and released by emergency().
+    gc.threshold is the number of bytes allocated between automatic
+    collections, it's set to 1/threshold_part of the free heap, so
+    garbage is collected before the allocation fails even if idle
+    gaps are rare.
+    idle() collects garbage if the idle gap is at least min_gap
+    milliseconds and at least min_alloc bytes were allocated
+    since the last collection
+    """
+
+    def __init__(self, reserve, exc_buf, threshold_part, min_gap, min_alloc):
+        # interrupt handlers couldn't allocate memory for their exceptions
+        micropython.alloc_emergency_exception_buf(exc_buf)
+        self.reserve_size = reserve
+        self.reserve = bytearray(reserve)
+        self.min_gap = min_gap
+        self.min_alloc = min_alloc
+
+        gc.collect()
+        gc.threshold(gc.mem_free() // threshold_part)
+        self.alloc = gc.mem_alloc()
+
+        self.collections = 0
+        self.gc_max = 0
+        self.emergencies = 0
+
+    def idle(self, t):
+        """
+        Uses idle gap of t milliseconds for the garbage collection if needed
+
+        Returns milliseconds left of the gap
+        """
+        if t < self.min_gap or gc.mem_alloc() - self.alloc < self.min_alloc:
+            return t
+
+        t0 = utime.ticks_ms()
+        gc.collect()
+        if self.reserve == None:
+            # emergency reserve is restored on the collected heap
+            try:
+                self.reserve = bytearray(self.reserve_size)
+            except MemoryError:
+                pass
+        self.alloc = gc.mem_alloc()
+        dt = utime.ticks_diff(utime.ticks_ms(), t0)
+        self.collections += 1
+        if dt > self.gc_max:
+            self.gc_max = dt
+
+        return max(0, t - dt)
+
+    def emergency(self):
+        """
+        Releases the reserve and collects garbage after MemoryError
+        """
+        self.emergencies += 1
+        self.reserve = None
+        gc.collect()
+        self.alloc = gc.mem_alloc()
+
+    def largest_block(self):
+        """
+        Returns the size of the largest block which could be allocated
+
+        Probes allocations, so it's used only by explicit frag() request
+        """
+        lo = 0
+        hi = gc.mem_free()
+        while lo < hi:
+            n = (lo + hi + 1) // 2
+            try:
+                b = bytearray(n)
+                b = None
+                lo = n
+            except MemoryError:
+                hi = n - 1
+
+        return lo
+
+    def report(self):
+        """
+        Returns memory manager counters as text
+
+        gc:{idle collections}:{max collection time ms}:{emergencies}
+        """
+        return "gc:{}:{}:{}".format(self.collections, self.gc_max,
+                                    self.emergencies).encode()
+
+    def frag(self):
+        """
+        Collects garbage and returns heap fragmentation as text
+
+        frag:{free}:{largest free block}:{fragmentation percent}
+        Probes the heap with allocations up to the free heap size,
+        so it's a diagnostic request rather than a counter
+        """
+        gc.collect()
+        self.alloc = gc.mem_alloc()
+        f = gc.mem_free()
+        lb = self.largest_block()
+        if f > 0:
+            frag = 100 - lb * 100 // f
+        else:
+            frag = 0
+
+        return "frag:{}:{}:{}".format(f, lb, frag).encode()
+#------------------------------------------------------------------------------
@@ -0,0 +1,139 @@
+"""
+Outgoing mqtt messages queue
+
+Messages are published in batches with global and per-topic rate limits.
+State messages which aren't published yet are superseded by the newer
+ones of the same kind on the same topic
+
+(c) Dr. Dobermann, 2018.
+"""
+
+import utime
+
+
+class PublishQueue():
+    """
+    Bounded queue of outgoing messages
+
+    publish is a function(topic, msg) which actually sends the message.
+    Global rate limit is a token bucket with rate messages per second
+    and burst messages at most. interval is the minimum time between
+    messages on the same topic in milliseconds. Zero rate or interval
+    disables the limit.
+    If the queue is full, the oldest message is dropped
+    """
+
+    def __init__(self, publish, size, batch, rate, burst, interval):
+        self.publish = publish
+        self.size = size
+        self.batch = batch
+        self.interval = interval
+        # list of [topic, msg, coalesce key or None] waiting for publishing
+        self.queue = []
+        # queued entries which could be superseded by (topic, id(kind))
+        self.pending = dict()
+        # last publish time by topic
+        self.last = dict()
+
+        # token bucket is kept in milliseconds of credit
+        # every message costs period milliseconds
+        if rate > 0:
+            self.period = 1000 // rate
+        else:
+            self.period = 0
+        self.credit_max = burst * self.period
+        self.credit = self.credit_max
+        self.credit_time = utime.ticks_ms()
+
+        self.dropped = 0
+        self.coalesced = 0
+        self.published = 0
+
+    def put(self, topic, msg, kind = None):
+        """
+        Queues the message
+
+        If kind isn't None, the message replaces not yet published message
+        on the same topic queued with the very same kind object. Usually
+        it's the reply buffer, so messages written into different buffers
+        are never merged and the buffer is never queued twice
+        """
+        key = None
+        if kind != None:
+            key = (topic, id(kind))
+            e = self.pending.get(key)
+            if e != None:
+                e[1] = msg
+                self.coalesced += 1
+                return
+
+        if len(self.queue) >= self.size:
+            e = self.queue.pop(0)
+            if e[2] != None and self.pending.get(e[2]) is e:
+                del self.pending[e[2]]
+            self.dropped += 1
+            print("WARNING: Publish queue is full, message on", e[0], "dropped")
+
+        e = [topic, msg, key]
+        self.queue.append(e)
+        if key != None:
+            self.pending[key] = e
+
+    def free(self):
+        """
+        Returns number of messages which could be queued without dropping
+        """
+        return self.size - len(self.queue)
+
+    def queued(self, msg):
+        """
+        Returns True if the very msg object is waiting for publishing
+        """
+        for e in self.queue:
+            if e[1] is msg:
+                return True
+
+        return False
+
+    def busy(self):
+        """
+        Returns True if there are messages waiting for publishing
+        """
+        return len(self.queue) > 0
+
+    def drain(self, flush = False):
+        """
+        Publishes no more than batch queued messages allowed by rate limits
+
+        If flush is True, all messages are published regardless of limits
+        """
+        now = utime.ticks_ms()
+        if self.period > 0:
+            self.credit = min(self.credit_max, self.credit + utime.ticks_diff(now, self.credit_time))
+            self.credit_time = now
+
+        sent = 0
+        i = 0
+        while i < len(self.queue) and (flush or sent < self.batch):
+            e = self.queue[i]
+            if not flush:
+                if self.period > 0 and self.credit < self.period:
+                    break
+                # messages on limited topic stay in the queue in their order
+                if self.interval > 0 and e[0] in self.last and \
+                   utime.ticks_diff(now, self.last[e[0]]) < self.interval:
+                    i += 1
+                    continue
+
+            self.queue.pop(i)
+            if e[2] != None and self.pending.get(e[2]) is e:
+                del self.pending[e[2]]
+
+            self.publish(e[0], e[1])
+            self.last[e[0]] = now
+            self.credit -= self.period
+            self.published += 1
+            sent += 1
+
+        return sent
+#------------------------------------------------------------------------------
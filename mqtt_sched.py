@@ -0,0 +1,89 @@
+"""
+Link scheduler
+
+Keeps deadlines of mqtt links in a min-heap so the main cycle processes
+only links which are due and knows how long it could sleep
+
+(c) Dr. Dobermann, 2018.
+"""
+
+import utime
+import uheapq
+
+
+class Scheduler():
+    """
+    Min-heap of link deadlines
+
+    Deadlines are kept on a monotonic millisecond clock built from
+    utime.ticks_diff, so ticks wraparound doesn't break the heap order.
+    Rescheduled and cancelled links leave stale entries in the heap,
+    they are dropped when reach the heap top
+    """
+
+    def __init__(self):
+        self.heap = []
+        # current deadline for every scheduled key
+        self.due = dict()
+        self.last_ticks = utime.ticks_ms()
+        self.clock = 0
+
+    def now(self):
+        """
+        Returns milliseconds passed since the scheduler creation
+        """
+        t = utime.ticks_ms()
+        self.clock += utime.ticks_diff(t, self.last_ticks)
+        self.last_ticks = t
+
+        return self.clock
+
+    def schedule(self, key, delay):
+        """
+        Sets the key deadline in delay milliseconds from now
+        """
+        dl = self.now() + delay
+        if self.due.get(key) == dl:
+            return
+        self.due[key] = dl
+        uheapq.heappush(self.heap, (dl, key))
+
+    def cancel(self, key):
+        """
+        Removes the key deadline if any
+        """
+        if key in self.due:
+            del self.due[key]
+
+    def pop_due(self):
+        """
+        Returns the list of keys which deadlines have been reached
+        and removes them from the scheduler
+        """
+        now = self.now()
+        keys = []
+        while len(self.heap) > 0 and self.heap[0][0] <= now:
+            dl, key = uheapq.heappop(self.heap)
+            if self.due.get(key) == dl:
+                del self.due[key]
+                keys.append(key)
+
+        return keys
+
+    def time_left(self, limit):
+        """
+        Returns milliseconds left to the nearest deadline
+        but no more than limit
+        """
+        now = self.now()
+        while len(self.heap) > 0:
+            dl, key = self.heap[0]
+            if self.due.get(key) != dl:
+                uheapq.heappop(self.heap)
+                continue
+            if dl - now < limit:
+                return max(0, dl - now)
+            break
+
+        return limit
+#------------------------------------------------------------------------------
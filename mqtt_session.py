@@ -0,0 +1,285 @@
+"""
+MQTT session
+
+Keeps the mqtt connection over umqtt.simple client without blocking
+the controller while the server is unreachable. Messages published
+offline are kept in a ring buffer which spills to flash when it's full
+and are replayed in order after reconnect
+
+(c) Dr. Dobermann, 2018.
+"""
+
+import os
+import struct
+import utime
+from umqtt.simple import MQTTClient, MQTTException
+
+try:
+    import network
+except ImportError:
+    network = None
+
+# spill file record header: topic length, message length
+RECORD = "!HH"
+RECORD_SIZE = struct.calcsize(RECORD)
+
+
+class Session():
+    """
+    mqtt connection with reconnect backoff and offline buffer
+
+    Connection errors don't raise, the session goes offline and the next
+    connection attempt is made by service() after the backoff time, which
+    doubles from backoff_min up to backoff_max milliseconds on every failure.
+    No attempt is made while WiFi station isn't connected. Otherwise
+    single connection attempt still blocks in umqtt.simple connect()
+    until the server name is resolved and the socket gives up
+
+    Offline messages are kept in the ring of size messages. If spill is
+    a file name, messages which don't fit into the ring are appended to
+    the file up to spill_size bytes, otherwise the oldest ring message
+    is dropped. The spill file left from the previous run is replayed
+    as well. Once there are buffered messages, new ones are buffered
+    after them to keep the order
+    """
+
+    def __init__(self, client_id, server, size, spill, spill_size,
+                 backoff_min, backoff_max, batch):
+        self.cli = MQTTClient(client_id, server)
+        # WiFi station interface or None on ports without network module
+        self.wlan = None
+        if network != None:
+            self.wlan = network.WLAN(network.STA_IF)
+        self.cb = None
+        # topics to subscribe on every connection
+        self.subs = []
+        self.connected = False
+        self.backoff_min = backoff_min
+        self.backoff_max = backoff_max
+        self.backoff = backoff_min
+        self.retry_at = utime.ticks_ms()
+        # messages replayed in one service() call
+        self.batch = batch
+
+        # offline ring of [topic, msg]
+        self.ring = [None] * size
+        self.head = 0
+        self.count = 0
+
+        self.spill = spill
+        self.spill_size = spill_size
+        # spill file size, the read position and the size of the next record
+        self.spilled = 0
+        self.spill_pos = 0
+        self.spill_next = 0
+        if spill != None:
+            try:
+                with open(spill, "rb") as f:
+                    self.spilled = f.seek(0, 2)
+            except OSError:
+                pass
+
+        self.dropped = 0
+        self.replayed = 0
+        self.buffered = 0
+        self.reconnects = 0
+
+    @property
+    def sock(self):
+        """
+        Socket of the connected client or None
+        """
+        if self.connected:
+            return self.cli.sock
+
+        return None
+
+    def set_callback(self, f):
+        self.cb = f
+        self.cli.set_callback(f)
+
+    def connect(self):
+        """
+        Makes single connection attempt and subscribes for session topics
+
+        Returns True if the session is connected
+        """
+        # umqtt.simple connect() would block until DNS and TCP timeouts
+        if self.wlan != None and not self.wlan.isconnected():
+            print("WARNING: WiFi isn't connected, next try in", self.backoff, "ms")
+            self.fail()
+            return False
+
+        try:
+            self.cli.connect(clean_session = False)
+            for t in self.subs:
+                self.cli.subscribe(t)
+        except (OSError, MQTTException) as e:
+            print("WARNING: mqtt connection failed:", e, "next try in", self.backoff, "ms")
+            self.fail()
+            return False
+
+        if self.reconnects > 0:
+            print("Reconnected,", self.count, "messages and",
+                  self.spilled - self.spill_pos, "spilled bytes to replay")
+        self.reconnects += 1
+        self.connected = True
+        self.backoff = self.backoff_min
+
+        return True
+
+    def fail(self):
+        """
+        Turns the session offline and schedules the next connection attempt
+        """
+        if self.connected:
+            print("WARNING: mqtt connection lost")
+            try:
+                self.cli.sock.close()
+            except Exception:
+                pass
+        self.connected = False
+        self.retry_at = utime.ticks_add(utime.ticks_ms(), self.backoff)
+        self.backoff = min(self.backoff * 2, self.backoff_max)
+
+    def disconnect(self):
+        if self.connected:
+            try:
+                self.cli.disconnect()
+            except OSError:
+                pass
+        self.connected = False
+
+    def subscribe(self, topic):
+        """
+        Adds the topic to the session subscriptions
+        """
+        self.subs.append(topic)
+        if self.connected:
+            try:
+                self.cli.subscribe(topic)
+            except OSError:
+                self.fail()
+
+    def publish(self, topic, msg):
+        """
+        Publishes the message or buffers it while the session is offline
+        """
+        if self.connected and not self.backlog():
+            try:
+                self.cli.publish(topic, msg)
+                return
+            except OSError:
+                self.fail()
+
+        self.put(topic, msg)
+
+    def check_msg(self):
+        if not self.connected:
+            return
+
+        try:
+            self.cli.check_msg()
+        except OSError:
+            self.fail()
+
+    def service(self):
+        """
+        Reconnects if it's time to and replays buffered messages
+        """
+        if not self.connected:
+            if utime.ticks_diff(utime.ticks_ms(), self.retry_at) < 0 or not self.connect():
+                return
+
+        n = 0
+        while self.connected and n < self.batch and self.backlog():
+            topic, msg = self.peek()
+            try:
+                self.cli.publish(topic, msg)
+            except OSError:
+                self.fail()
+                return
+            self.pop()
+            self.replayed += 1
+            n += 1
+
+    def time_left(self, limit):
+        """
+        Returns milliseconds left until the session needs service()
+        but no more than limit
+        """
+        if not self.connected:
+            return max(0, min(limit, utime.ticks_diff(self.retry_at, utime.ticks_ms())))
+
+        if self.backlog():
+            return 0
+
+        return limit
+
+    def backlog(self):
+        """
+        Returns True if there are buffered messages
+        """
+        return self.count > 0 or self.spill_pos < self.spilled
+
+    def put(self, topic, msg):
+        """
+        Buffers the message after already buffered ones
+        """
+        # link reply buffers are reused, so the message is copied
+        msg = bytes(msg)
+        self.buffered += 1
+
+        if self.spilled == 0 and self.count < len(self.ring):
+            self.ring[(self.head + self.count) % len(self.ring)] = [topic, msg]
+            self.count += 1
+            return
+
+        if self.spill != None and \
+           self.spilled + RECORD_SIZE + len(topic) + len(msg) <= self.spill_size:
+            try:
+                with open(self.spill, "ab") as f:
+                    f.write(struct.pack(RECORD, len(topic), len(msg)))
+                    f.write(topic)
+                    f.write(msg)
+                self.spilled += RECORD_SIZE + len(topic) + len(msg)
+                return
+            except OSError as e:
+                print("WARNING: Couldn't spill message to", self.spill, e)
+
+        if self.spill == None:
+            # ring keeps the newest messages
+            self.ring[self.head] = [topic, msg]
+            self.head = (self.head + 1) % len(self.ring)
+        self.dropped += 1
+
+    def peek(self):
+        """
+        Returns the oldest buffered message as [topic, msg]
+        """
+        if self.count > 0:
+            return self.ring[self.head]
+
+        with open(self.spill, "rb") as f:
+            f.seek(self.spill_pos)
+            tl, ml = struct.unpack(RECORD, f.read(RECORD_SIZE))
+            self.spill_next = RECORD_SIZE + tl + ml
+            return [f.read(tl), f.read(ml)]
+
+    def pop(self):
+        """
+        Removes the oldest buffered message
+        """
+        if self.count > 0:
+            self.ring[self.head] = None
+            self.head = (self.head + 1) % len(self.ring)
+            self.count -= 1
+            return
+
+        # spilled message is always peeked before
+        self.spill_pos += self.spill_next
+        if self.spill_pos >= self.spilled:
+            os.remove(self.spill)
+            self.spilled = 0
+            self.spill_pos = 0
+#------------------------------------------------------------------------------
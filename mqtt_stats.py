@@ -0,0 +1,117 @@
+"""
+Runtime performance counters
+
+Keeps call counts and durations of verb processors and link checks,
+main cycle histogram and heap watermarks
+
+(c) Dr. Dobermann, 2018.
+"""
+
+import gc
+import utime
+
+# upper bounds of run() cycle histogram buckets in microseconds,
+# the last bucket holds longer cycles
+CYCLE_BOUNDS = (100, 1000, 10000, 100000)
+
+# run() cycles between heap samples
+MEM_SAMPLE_CYCLES = 100
+
+
+class Stats():
+    """
+    Performance counters
+
+    Durations are kept in microseconds as [count, total, min, max]
+    """
+
+    def __init__(self):
+        # durations by function
+        self.calls = dict()
+        self.cycle = [0, 0, 0, 0]
+        self.hist = [0] * (len(CYCLE_BOUNDS) + 1)
+        self.errors = 0
+        self.mem_free_min = -1
+        self.mem_alloc_max = 0
+
+    def call(self, fn, t0):
+        """
+        Adds the call of fn started at t0 microseconds ticks
+        """
+        dt = utime.ticks_diff(utime.ticks_us(), t0)
+        c = self.calls.get(fn)
+        if c == None:
+            self.calls[fn] = [1, dt, dt, dt]
+            return
+        add(c, dt)
+
+    def run(self, t0):
+        """
+        Adds run() cycle started at t0 microseconds ticks
+        """
+        dt = utime.ticks_diff(utime.ticks_us(), t0)
+        add(self.cycle, dt)
+        ii = 0
+        while ii < len(CYCLE_BOUNDS) and dt > CYCLE_BOUNDS[ii]:
+            ii += 1
+        self.hist[ii] += 1
+
+        # heap is sampled only every MEM_SAMPLE_CYCLES cycles
+        if self.cycle[0] % MEM_SAMPLE_CYCLES == 0:
+            self.memory()
+
+    def memory(self):
+        """
+        Samples heap watermarks
+        """
+        f = gc.mem_free()
+        a = gc.mem_alloc()
+        if self.mem_free_min == -1 or f < self.mem_free_min:
+            self.mem_free_min = f
+        if a > self.mem_alloc_max:
+            self.mem_alloc_max = a
+
+        return f, a
+
+    def report(self):
+        """
+        Returns the counters as lines of text
+
+        mem:{free}:{allocated}:{min free}:{max allocated}
+        errors:{published error messages}
+        cycle:{count}:{min}:{avg}:{max}:{histogram counts separated by /}
+        {function}:{count}:{min}:{avg}:{max}
+        """
+        f, a = self.memory()
+        r = "mem:{}:{}:{}:{}\nerrors:{}\ncycle:{}:{}\n".format(
+            f, a, self.mem_free_min, self.mem_alloc_max, self.errors,
+            durations(self.cycle), "/".join([str(n) for n in self.hist]))
+        for fn, c in self.calls.items():
+            r += "{}:{}\n".format(fn.__name__, durations(c))
+
+        return r.encode()
+#------------------------------------------------------------------------------
+
+
+
+def add(c, dt):
+    """
+    Adds the duration to [count, total, min, max]
+    """
+    c[0] += 1
+    c[1] += dt
+    if c[0] == 1 or dt < c[2]:
+        c[2] = dt
+    if dt > c[3]:
+        c[3] = dt
+
+
+
+def durations(c):
+    """
+    Formats [count, total, min, max] as count:min:avg:max
+    """
+    if c[0] == 0:
+        return "0:0:0:0"
+
+    return "{}:{}:{}:{}".format(c[0], c[2], c[1] // c[0], c[3])
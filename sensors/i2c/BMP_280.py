@@ -10,13 +10,45 @@ Usually BMP-280 sits on 0x76.
 """
 
 from machine import I2C
-from utime import sleep_ms
 
 from ..sens_cont import I2CSensorController
+import mqtt_link_consts as mlc
 
 BMP280_ADDR = 0x76
 BMP280_DATA = 0xF7
 BMP280_COMPENSATE_REGS = 0x88
+BMP280_CTRL_MEAS = 0xF4
+BMP280_CONFIG = 0xF5
+
+# power modes
+MODE_SLEEP  = 0
+MODE_FORCED = 1
+MODE_NORMAL = 3
+
+# oversampling codes for osrs_t and osrs_p
+OSRS_SKIP = 0
+OSRS_X1   = 1
+OSRS_X2   = 2
+OSRS_X4   = 3
+OSRS_X8   = 4
+OSRS_X16  = 5
+
+# IIR filter coefficients
+FILTER_OFF = 0
+FILTER_2   = 1
+FILTER_4   = 2
+FILTER_8   = 3
+FILTER_16  = 4
+
+# standby time between measurements in normal mode
+STANDBY_0_5  = 0 # 0.5 ms
+STANDBY_62_5 = 1 # 62.5 ms
+STANDBY_125  = 2
+STANDBY_250  = 3
+STANDBY_500  = 4
+STANDBY_1000 = 5
+STANDBY_2000 = 6
+STANDBY_4000 = 7
 
 T1 = 0
 T2 = 1
@@ -43,12 +75,42 @@ P_MSB = 0
 P_LSB = 1
 P_XLSB = 2
 
+
+def conv_time(osrs_t, osrs_p):
+    """
+    Returns maximum measurement time in milliseconds according to datasheet
+    """
+    # oversampling code n means 2^(n-1) samples
+    nt = 0 if osrs_t == OSRS_SKIP else 1 << (osrs_t - 1)
+    np = 0 if osrs_p == OSRS_SKIP else 1 << (osrs_p - 1)
+    us = 1250 + 2300 * nt
+    if np > 0:
+        us += 2300 * np + 575
+
+    return us // 1000 + 1
+
+
+
 class BMP_280(I2CSensorController):
-    def __init__(self, i2c, addr = BMP280_ADDR):
+    """
+    In forced mode (default) every update starts single measurement.
+    In normal mode the sensor measures continuously with standby time
+    between measurements and update only reads the last result
+    """
+
+    FIELDS = (mlc.F_TEMP, mlc.F_PRESSURE)
+
+    def __init__(self, i2c, addr = BMP280_ADDR, mode = MODE_FORCED,
+                 osrs_t = OSRS_X1, osrs_p = OSRS_X8,
+                 standby = STANDBY_0_5, iir = FILTER_OFF):
         I2CSensorController.__init__(self, i2c, addr)
         self.temp = 0.0
         self.t_fine = 0
         self.pressure = 0.0
+        # temperature in 0.01 C
+        self.t100 = 0
+        # pressure in Pa as Q24.8
+        self.p256 = 0
         self.data = bytearray(6)
 
         # read compensation bytes table
@@ -62,39 +124,86 @@ class BMP_280(I2CSensorController):
             else:
                 self.dig.append(cb[ii*2 + 1] << 8 | cb[ii*2])
 
+        # precompute compensation constants
+        d = self.dig
+        self.c_t1 = d[T1]
+        self.c_t1x2 = d[T1] << 1
+        self.c_t2 = d[T2]
+        self.c_t3 = d[T3]
+        self.c_p1 = d[P1]
+        self.c_p2 = d[P2]
+        self.c_p3 = d[P3]
+        self.c_p4 = d[P4] << 35
+        self.c_p5 = d[P5] << 17
+        self.c_p6 = d[P6]
+        self.c_p7 = d[P7] << 4
+        self.c_p8 = d[P8]
+        self.c_p9 = d[P9]
+
+        self.mode = mode
+        self.ctrl = bytearray(1)
+        self.ctrl[0] = osrs_t << 5 | osrs_p << 2 | mode
+        self.conv_time = conv_time(osrs_t, osrs_p)
+
+        if mode == MODE_NORMAL:
+            # config register could be ignored in normal mode
+            # so it's written while the sensor sleeps
+            i2c.writeto_mem(self.addr, BMP280_CTRL_MEAS, bytes((MODE_SLEEP,)))
+            i2c.writeto_mem(self.addr, BMP280_CONFIG, bytes((standby << 5 | iir << 2,)))
+            i2c.writeto_mem(self.addr, BMP280_CTRL_MEAS, self.ctrl)
+        else:
+            i2c.writeto_mem(self.addr, BMP280_CONFIG, bytes((iir << 2,)))
+
         self.status = self.OK
 
-    def update(self):
-        self.value = b""
+    def start(self):
+        if self.mode == MODE_NORMAL:
+            # sensor measures continuously, the last result is ready
+            return 0
+
         # force update
-        self.i2c.writeto_mem(self.addr, 0xf4, b"1")
-        sleep_ms(100)
+        self.i2c.writeto_mem(self.addr, BMP280_CTRL_MEAS, self.ctrl)
+        return self.conv_time
+
+    def collect(self):
+        self.value = None
         self.i2c.readfrom_mem_into(self.addr, BMP280_DATA, self.data)
 
         # calculate temp
         rt = ((self.data[T_MSB] << 8 | self.data[T_LSB]) << 8 | self.data[T_XLSB]) >> 4
-        t_v1 = (((rt >> 3) - (self.dig[T1] << 1)) * self.dig[T2]) >> 11
-        t_v2 = (((((rt >> 4) - self.dig[T1]) * ((rt >> 4) - self.dig[T1])) >> 12) * self.dig[T3]) >> 14
+        t_v1 = (((rt >> 3) - self.c_t1x2) * self.c_t2) >> 11
+        t_v2 = (((((rt >> 4) - self.c_t1) * ((rt >> 4) - self.c_t1)) >> 12) * self.c_t3) >> 14
         self.t_fine = t_v1 + t_v2
-        self.temp = ((self.t_fine * 5 + 128) >> 8) / 100
+        self.t100 = (self.t_fine * 5 + 128) >> 8
 
         # calculate pressure
         rp = ((self.data[P_MSB] << 8 | self.data[P_LSB]) << 8 | self.data[P_XLSB]) >> 4
     
         p_v1 = self.t_fine - 128000
-        p_v2 = p_v1 * p_v1 * self.dig[P6]
-        p_v2 += self.dig[P5] << 17
-        p_v2 += self.dig[P4] << 35
-        p_v1 = ((p_v1 * p_v1 * self.dig[P3]) >> 8) + ((p_v1 * self.dig[P2]) << 12)
-        p_v1 = ((1 << 47) + p_v1) * self.dig[P1] >> 33
+        p_v2 = p_v1 * p_v1 * self.c_p6
+        p_v2 += p_v1 * self.c_p5
+        p_v2 += self.c_p4
+        p_v1 = ((p_v1 * p_v1 * self.c_p3) >> 8) + ((p_v1 * self.c_p2) << 12)
+        p_v1 = ((1 << 47) + p_v1) * self.c_p1 >> 33
         if p_v1 != 0:
             p = 1048576 - rp
-            p = int((((p << 31) - p_v2) * 3125) / p_v1)
-            p_v1 = (self.dig[11] * (p >> 13) * (p >> 13)) >> 25
-            p_v2 = (self.dig[10] * p) >> 19
-            p = ((p + p_v1 + p_v2) >> 8) + (self.dig[9] << 4)
+            p = (((p << 31) - p_v2) * 3125) // p_v1
+            p_v1 = (self.c_p9 * (p >> 13) * (p >> 13)) >> 25
+            p_v2 = (self.c_p8 * p) >> 19
+            p = ((p + p_v1 + p_v2) >> 8) + self.c_p7
         else:
             p = 0
 
-        self.pressure = p / 256
-        self.value = b"{}".format(self.temp) + " C:" + b"{}".format(self.pressure) + " Pa"
+        self.p256 = p
+
+    def format_value(self):
+        self.temp = self.t100 / 100
+        self.pressure = self.p256 / 256
+
+        return "{} C:{} Pa".format(self.temp, self.pressure).encode()
+
+    def fixed(self, i):
+        if i == 0:
+            return self.t100
+
+        return self.p256 * 100 // 256
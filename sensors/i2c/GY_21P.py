@@ -6,19 +6,75 @@ This sensor is actually a combination of two sensors BPM-280 and Si7021-A20
 (c) Dr. Dobermann, 2018.
 """
 
+from utime import ticks_ms, ticks_diff
+
 from ..sens_cont import I2CSensorController
 from .BMP_280 import BMP_280
 from .Si7021_A20 import SI7021
 
 class GY_21P(I2CSensorController):
-    def __init__(self, i2c, addr = None):
+
+    FIELDS = BMP_280.FIELDS + SI7021.FIELDS
+
+    def __init__(self, i2c, addr = None, bmp280 = None, si7021 = None, **bmp280_opts):
         I2CSensorController.__init__(self, i2c, addr)
-        self.bmp280 = BMP_280(self.i2c)
-        self.si7021 = SI7021(self.i2c)
+        # already created sub-sensors are shared, so their results
+        # and conversions are common for all links which use them.
+        # options are passed to BMP-280 driver (mode, oversampling, filter)
+        if bmp280 == None:
+            bmp280 = BMP_280(self.i2c, **bmp280_opts)
+        if si7021 == None:
+            si7021 = SI7021(self.i2c)
+        self.bmp280 = bmp280
+        self.si7021 = si7021
         if self.bmp280.status == self.OK and self.si7021.status == self.OK:
             self.status = self.OK
 
-    def update(self):
-        self.bmp280.update()
-        self.si7021.update()
-        self.value = self.bmp280.get_value() + ":" + self.si7021.get_value()
\ No newline at end of file
+    def start(self):
+        # both conversions run simultaneously
+        return max(self.start_part(self.bmp280), self.start_part(self.si7021))
+
+    def start_part(self, p):
+        """
+        Starts the sub-sensor conversion and returns milliseconds to wait
+
+        Sub-sensor which is already converting for its own links
+        isn't restarted, its result is waited for
+        """
+        if p.converting:
+            return max(0, ticks_diff(p.ready, ticks_ms()))
+
+        return p.start()
+
+    def collect(self):
+        self.bmp280.collect()
+        self.si7021.collect()
+        # sub-sensors results are shared with links on them
+        self.bmp280.done()
+        self.si7021.done()
+        self.value = None
+
+    def fresh(self, max_age):
+        # sub-sensors could be updated by their own links
+        return self.bmp280.fresh(max_age) and self.si7021.fresh(max_age)
+
+    def result_id(self):
+        return self.bmp280.results + self.si7021.results
+
+    def get_value(self, update = False):
+        # sub-sensors could be updated by other links, so the text
+        # is joined from their own cached values every time
+        if update:
+            self.update()
+
+        return self.format_value()
+
+    def format_value(self):
+        return self.bmp280.get_value() + b":" + self.si7021.get_value()
+
+    def fixed(self, i):
+        n = len(self.bmp280.FIELDS)
+        if i < n:
+            return self.bmp280.fixed(i)
+
+        return self.si7021.fixed(i - n)
\ No newline at end of file
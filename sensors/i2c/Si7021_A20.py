@@ -8,11 +8,15 @@ Usually the sensor holds x40 address
 """
 
 from machine import I2C
-from utime import sleep_ms
 
 from ..sens_cont import I2CSensorController
+import mqtt_link_consts as mlc
 
 SI7021_ADDR = 0x40
+# according to datasheet sensors sends NACK until the data isn't ready
+# in the same datasheet max time to data preparation is 12 ms
+# experimentally I found that data is ready after 16 ms
+SI7021_CONV_TIME = 20 # milliseconds
 
 
 class SI7021(I2CSensorController):
@@ -20,27 +24,38 @@ class SI7021(I2CSensorController):
     GET_RHUM_CMD = b"\xF5"
     GET_TEMP_CMD = b"\xE0"
 
+    FIELDS = (mlc.F_RHUM, mlc.F_TEMP)
+
     def __init__(self, i2c, addr = SI7021_ADDR):
         I2CSensorController.__init__(self, i2c, addr)
         self.buf = bytearray(2)
         self.temp = 0.0
         self.rHum = 0.0
+        # last measured codes
+        self.rh_code = 0
+        self.t_code = 0
         self.status = self.OK
 
-    def update(self):
-        # get RH_Code
+    def start(self):
+        # start RH conversion
         self.i2c.writeto(self.addr, self.GET_RHUM_CMD, True)
-        # according to datasheet sensors sends NACK until the data isn't ready
-        # in the same datasheet max time to data preparation is 12 ms
-        # experimentally I found that data is ready after 16 ms
-        sleep_ms(20) 
+        return SI7021_CONV_TIME
+
+    def collect(self):
+        self.value = None
+
+        # get RH_Code
         self.i2c.readfrom_into(self.addr, self.buf, True)
-        self.rHum = (125 * (self.buf[0] << 8 | self.buf[1]))/65536 - 6
+        self.rh_code = self.buf[0] << 8 | self.buf[1]
        
-        # get Temp_Code
+        # get Temp_Code measured during the last RH conversion
         self.i2c.writeto(self.addr, self.GET_TEMP_CMD, True)
         self.i2c.readfrom_into(self.addr, self.buf, True)
-        self.temp = (175.72 * (self.buf[0] << 8 | self.buf[1]))/65536 - 46.85
+        self.t_code = self.buf[0] << 8 | self.buf[1]
+
+    def format_value(self):
+        self.rHum = (125 * self.rh_code)/65536 - 6
+        self.temp = (175.72 * self.t_code)/65536 - 46.85
         
         # normalize relative humidity
         # it could be slightly lesser than 0 or slightly higher than 100
@@ -50,6 +65,13 @@ class SI7021(I2CSensorController):
         elif self.rHum > 100:
             self.rHum = 100
 
+        return "{} %:{} C".format(self.rHum, self.temp).encode()
+
+    def fixed(self, i):
+        if i == 0:
+            # relative humidity in 0.01 % normalized as in format_value
+            v = ((12500 * self.rh_code) >> 16) - 600
+            return min(10000, max(0, v))
 
-        self.value = b"{}".format(self.rHum) + " %:" + b"{}".format(self.temp) + " C"
+        return ((17572 * self.t_code) >> 16) - 4685
     
\ No newline at end of file
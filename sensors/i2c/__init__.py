@@ -4,31 +4,153 @@ Init for I2C sensors
 (c) Dr. Dobermann, 2018.
 """
 
-from sensors.sens_cont import I2CSensorController
-from machine import I2C, Pin
+import sys
+from utime import ticks_us, ticks_diff
 
+from sensors.i2c.bus import I2CBus
+
+# I2CBus managers by (sda, scl)
 i2c_buses = dict()
+# sensor drivers by name as [module, class name, I2C addresses, parts]
+drivers = dict()
+# sensor names by their I2C addresses for autodetection
+KNOWN_ADDRS = dict()
+# import times of driver modules in microseconds by module name
+load_times = dict()
+# created sensor controllers by (sda, scl, name)
+sensors = dict()
 
-def get_sensor(sda_, scl_, name):
+def register(name, module, cls, addrs = (), parts = ()):
+    """
+    Registers the sensor driver
 
-    global i2c_buses
+    Driver module is imported only when the sensor is created for the
+    first time, so unused drivers don't take memory and could be frozen
+    into the firmware as well as loaded from the file system.
+    addrs are I2C addresses the sensor is detected by.
+    parts are (driver argument, sensor name) pairs of separate sensors
+    combined by the driver, they are shared with links on those sensors
+    """
 
-    #create I2C bus if needed
-    if (sda_, scl_) in i2c_buses:
-        i2c = i2c_buses[(sda_, scl_)]
-    else:
-        i2c = I2C(sda = Pin(sda_), scl = Pin(scl_))
-        i2c_buses[(sda_, scl_)] = i2c
-        print("New I2C bus opened with", (sda_, scl_))
-
-    if name == "BMP-280":
-        from sensors.i2c.BMP_280 import BMP_280 as Sensor
-    elif name == "SI7021":
-        from sensors.i2c.Si7021_A20 import SI7021 as Sensor
-    elif name == "GY-21P":
-        from sensors.i2c.GY_21P import GY_21P as Sensor
-    else:
+    drivers[name] = [module, cls, addrs, parts]
+    for a in addrs:
+        KNOWN_ADDRS[a] = name
+
+
+
+def load_driver(name):
+    """
+    Returns the driver class of the sensor importing its module if needed
+    or None if there is no such driver
+    """
+
+    d = drivers.get(name)
+    if d == None:
         print("FATAL: Could not find sensor:", name)
         return None
-    
-    return Sensor(i2c)
+
+    if d[0] not in sys.modules:
+        t0 = ticks_us()
+        try:
+            __import__(d[0])
+        except ImportError as e:
+            print("FATAL: Could not load sensor driver", d[0], e)
+            return None
+        load_times[d[0]] = ticks_diff(ticks_us(), t0)
+        print("Sensor driver", d[0], "is loaded in", load_times[d[0]], "us")
+
+    return getattr(sys.modules[d[0]], d[1])
+
+
+
+def get_sensor(sda_, scl_, name, opts = None):
+    """
+    Creates sensor controller on I2C bus
+
+    opts is an optional dictionary of the sensor driver arguments.
+    Sensor which is already created on the bus is returned as is,
+    so links on the same sensor share its results and conversions.
+    If name is "AUTO", the sensor is chosen by addresses found on the bus
+    """
+
+    global sensors
+
+    bus = get_bus(sda_, scl_)
+    if name == "AUTO":
+        name = auto_name(bus)
+        if name == None:
+            print("FATAL: No known sensors found on I2C bus", bus.pins)
+            return None
+
+    if (sda_, scl_, name) in sensors:
+        return sensors[(sda_, scl_, name)]
+
+    Sensor = load_driver(name)
+    if Sensor == None:
+        return None
+
+    if opts == None:
+        opts = dict()
+    else:
+        opts = dict(opts)
+
+    # already created parts are passed to the combined sensor driver
+    parts = drivers[name][3]
+    for arg, part in parts:
+        opts[arg] = sensors.get((sda_, scl_, part))
+
+    s = Sensor(bus.i2c, **opts)
+    s.bus = bus
+    for arg, part in parts:
+        p = getattr(s, arg)
+        p.bus = bus
+        sensors[(sda_, scl_, part)] = p
+
+    sensors[(sda_, scl_, name)] = s
+
+    return s
+
+
+
+def get_bus(sda_, scl_):
+    """
+    Returns the bus manager, the bus is opened and scanned if needed
+    """
+
+    global i2c_buses
+
+    if (sda_, scl_) in i2c_buses:
+        return i2c_buses[(sda_, scl_)]
+
+    bus = I2CBus(sda_, scl_)
+    i2c_buses[(sda_, scl_)] = bus
+    print("New I2C bus opened with", (sda_, scl_), "found:",
+          [KNOWN_ADDRS.get(a, hex(a)) for a in bus.addrs])
+
+    return bus
+
+
+
+def auto_name(bus):
+    """
+    Returns the sensor name matched by addresses found on the bus
+
+    Combined sensor is chosen if all its parts are found (e.g. BMP-280
+    and SI7021 found together are taken as GY-21P)
+    """
+    names = [KNOWN_ADDRS[a] for a in bus.addrs if a in KNOWN_ADDRS]
+    for name, d in drivers.items():
+        if len(d[3]) > 0 and all([p[1] in names for p in d[3]]):
+            return name
+
+    if len(names) > 0:
+        return names[0]
+
+    return None
+
+
+
+register("BMP-280", "sensors.i2c.BMP_280", "BMP_280", (0x76, 0x77))
+register("SI7021", "sensors.i2c.Si7021_A20", "SI7021", (0x40,))
+register("GY-21P", "sensors.i2c.GY_21P", "GY_21P",
+         parts = (("bmp280", "BMP-280"), ("si7021", "SI7021")))
@@ -0,0 +1,84 @@
+"""
+I2C bus manager
+
+Owns the I2C object of the bus and runs transactions of all its sensors.
+Bus devices are scanned once the bus is opened
+
+(c) Dr. Dobermann, 2018.
+"""
+
+from utime import ticks_ms, ticks_add, ticks_diff
+from machine import I2C, Pin
+
+
+class I2CBus():
+    """
+    Transactions scheduler of sensors on one I2C bus
+
+    Sensors don't start and collect conversions on their own. They are
+    queued on the bus and service() starts requested conversions and
+    collects results of all bus sensors which are ready, in order of
+    their readiness. So the conversion wait of one sensor overlaps
+    transactions of the others and every ready result is read out
+    at the first chance. Sensor which transaction fails (e.g. NACK)
+    is marked failed and its conversion is over
+    """
+
+    def __init__(self, sda, scl):
+        self.pins = (sda, scl)
+        self.i2c = I2C(sda = Pin(sda), scl = Pin(scl))
+        try:
+            self.addrs = self.i2c.scan()
+        except OSError:
+            self.addrs = []
+        # sensors waiting for the conversion start
+        self.starting = []
+        # sensors with conversion in progress ordered by ready time
+        self.converting = []
+        # number of sensor starts and collects and of failed ones
+        self.transactions = 0
+        self.errors = 0
+
+    def request(self, s):
+        """
+        Queues the sensor conversion and services the bus
+        """
+        if s not in self.starting and s not in self.converting:
+            self.starting.append(s)
+        self.service()
+
+    def service(self):
+        """
+        Collects all ready results and starts queued conversions
+        """
+        # results go first, their sensors could be requested again
+        while len(self.converting) > 0 and \
+              ticks_diff(ticks_ms(), self.converting[0].ready) >= 0:
+            s = self.converting.pop(0)
+            # part of the combined sensor could be collected with it
+            if not s.converting:
+                continue
+            self.transactions += 1
+            try:
+                s.collect()
+                s.done()
+            except OSError as e:
+                self.errors += 1
+                s.fail(e)
+
+        while len(self.starting) > 0:
+            s = self.starting.pop(0)
+            self.transactions += 1
+            try:
+                s.ready = ticks_add(ticks_ms(), s.start())
+            except OSError as e:
+                # failed sensor isn't converting, so it's never left stuck
+                self.errors += 1
+                s.fail(e)
+                continue
+            ii = 0
+            while ii < len(self.converting) and \
+                  ticks_diff(self.converting[ii].ready, s.ready) <= 0:
+                ii += 1
+            self.converting.insert(ii, s)
+#------------------------------------------------------------------------------
@@ -6,6 +6,8 @@ Base classes for all sensors
 (c) Dr. Dobermann, 2018.
 """
 
+from utime import sleep_ms, ticks_ms, ticks_add, ticks_diff
+
 class SensorController():
     """
     Base class for all sensor's controllers
@@ -13,17 +15,137 @@ class SensorController():
     OK    = 1
     ERROR = 0
 
+    # types of fixed point fields returned by fixed(), mqtt_link_consts.F_*
+    FIELDS = ()
+
     def __init__(self):
+        # text value, None if it isn't formatted since the last update
         self.value = b""
         self.status = self.ERROR
+        # conversion state shared by all users of the sensor
+        self.converting = False
+        # time the conversion result will be ready
+        self.ready = 0
+        # time of the last result and number of results collected
+        self.updated = 0
+        self.results = 0
+        # True if the last conversion failed on the bus transaction,
+        # number of failures in a row and of all failures
+        self.failed = False
+        self.failures = 0
+        self.errors = 0
 
-    def update(self):
+    def start(self):
+        """
+        Starts the sensor conversion
+
+        Returns milliseconds to wait before the result could be collected
+        """
+        return 0
+
+    def collect(self):
+        """
+        Reads the conversion result started by start()
+
+        Drivers keep the result as numbers and set value to None,
+        so the text is formatted only if it's requested
+        """
         pass
 
+    def format_value(self):
+        """
+        Returns the text value of the last result
+        """
+        return b""
+
+    def fixed(self, i):
+        """
+        Returns the fixed point value of i-th field from FIELDS
+        """
+        return 0
+
+    def begin(self):
+        """
+        Starts the conversion if it isn't in progress yet
+
+        Returns the time the result will be ready, so everybody who asks
+        for the result during the conversion waits for the same one
+        """
+        if not self.converting:
+            try:
+                self.ready = ticks_add(ticks_ms(), self.start())
+                self.converting = True
+            except OSError as e:
+                self.fail(e)
+
+        return self.ready
+
+    def poll(self):
+        """
+        Collects the result of the conversion started by begin() if it's ready
+
+        Returns True if there is no conversion in progress
+        """
+        if self.converting and ticks_diff(ticks_ms(), self.ready) >= 0:
+            try:
+                self.collect()
+                self.done()
+            except OSError as e:
+                self.fail(e)
+
+        return not self.converting
+
+    def done(self):
+        """
+        Marks the collected result of the conversion
+        """
+        self.converting = False
+        self.failed = False
+        self.failures = 0
+        self.updated = ticks_ms()
+        self.results += 1
+
+    def fail(self, e):
+        """
+        Marks the conversion failed on the bus transaction
+
+        The conversion is over, so the sensor could be requested again
+        """
+        print("WARNING: Sensor", type(self).__name__, "transaction failed:", e)
+        self.converting = False
+        self.failed = True
+        self.failures += 1
+        self.errors += 1
+
+    def fresh(self, max_age):
+        """
+        Returns True if the last result is not older than max_age milliseconds
+        """
+        return not self.converting and self.results > 0 and \
+               ticks_diff(ticks_ms(), self.updated) <= max_age
+
+    def result_id(self):
+        """
+        Returns the number which changes with every new result
+        """
+        return self.results
+
+    def update(self):
+        """
+        Blocking update. Starts the conversion and waits for its result
+        """
+        wait = ticks_diff(self.begin(), ticks_ms())
+        if wait > 0:
+            sleep_ms(wait)
+        self.poll()
+
     def get_value(self, update = False):
         if update:
             self.update()
 
+        if self.value == None:
+            self.value = self.format_value()
+
         return self.value
 
     def sign16(self, u16):
@@ -41,9 +163,32 @@ class SensorController():
 class I2CSensorController(SensorController):
     """
     I2C sensor's controller base class
+
+    If the sensor is attached to the bus manager (sensors.i2c.bus.I2CBus),
+    its conversions are started and collected by the bus
     """
     def __init__(self, i2c, addr):
         SensorController.__init__(self)
         self.i2c = i2c
         self.addr = addr
+        self.bus = None
+
+    def begin(self):
+        if self.bus == None:
+            return SensorController.begin(self)
+
+        if not self.converting:
+            self.converting = True
+            self.bus.request(self)
+
+        return self.ready
+
+    def poll(self):
+        if self.bus == None:
+            return SensorController.poll(self)
+
+        if self.converting:
+            self.bus.service()
+
+        return not self.converting
 #------------------------------------------------------------------------------
\ No newline at end of file
@@ -0,0 +1,79 @@
+"""
+Host-side simulation harness
+
+Runs the controller under CPython with stand-ins for MicroPython modules
+(machine, micropython, network, utime, uselect, uheapq, umqtt.simple
+and gc functions), simulated pins, I2C sensors and an in-process MQTT broker.
+
+    import sim
+    broker = sim.install()
+    sim.add_i2c_device((5, 4), sim.BMP280Sim())
+
+install() should be called before mqtt_link is imported
+
+(c) Dr. Dobermann, 2018.
+"""
+
+import gc
+import os
+import sys
+import tracemalloc
+
+FAKES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fakes")
+
+# heap size reported by gc.mem_free() and gc.mem_alloc()
+HEAP_SIZE = 40 * 1024
+
+from sim.broker import Broker
+from sim.i2c_devices import BMP280Sim, Si7021Sim
+
+
+def install():
+    """
+    Puts fake MicroPython modules on the import path
+
+    Returns the broker fake mqtt clients are connected to
+    """
+    if FAKES_DIR not in sys.path:
+        sys.path.insert(0, FAKES_DIR)
+
+    # gc is a built-in module, so MicroPython functions are added to it.
+    # Allocated memory is known only while tracemalloc is tracing
+    gc.mem_alloc = lambda: tracemalloc.get_traced_memory()[0] if tracemalloc.is_tracing() else 0
+    gc.mem_free = lambda: max(0, HEAP_SIZE - gc.mem_alloc())
+    # automatic collection is left to CPython
+    gc.threshold = lambda amount = None: -1
+
+    import umqtt.simple
+
+    return umqtt.simple.broker
+
+
+
+def add_i2c_device(bus, dev):
+    """
+    Attaches simulated device to the I2C bus given as (sda, scl) pins
+    """
+    import machine
+
+    machine.i2c_devices.setdefault(tuple(bus), dict())[dev.addr] = dev
+
+
+
+def nack_i2c(bus, addr, n):
+    """
+    Makes the device NACK its next n transactions
+    """
+    import machine
+
+    machine.i2c_nacks[(tuple(bus), addr)] = n
+
+
+
+def set_pin(pin_id, v):
+    """
+    Drives input pin level and fires its interrupt handler on the edge
+    """
+    import machine
+
+    machine.drive(pin_id, v)
@@ -0,0 +1,197 @@
+"""
+Controller benchmarks over the host-side simulation harness
+
+Measures cb() dispatch latency, run() cycle time, publish throughput
+and memory allocated per message for the given number of links.
+
+    python -m sim.bench --links 50 --messages 2000
+
+Links are created as MOSFET, SWITCH and SENSOR_I2C in turn.
+Allocations are measured with tracemalloc as the peak of memory
+allocated while a message is processed, so they show CPython objects
+rather than exact MicroPython heap usage, but changes in them follow
+changes in the code
+
+(c) Dr. Dobermann, 2018.
+"""
+
+import argparse
+import os
+import sys
+import time
+import tracemalloc
+
+import sim
+
+broker = sim.install()
+
+import uselect
+import mqtt_link
+import mqtt_link_consts as mlc
+
+CNAME = b"bench"
+BUS = (5, 4)
+
+# controller debug output goes to devnull, results to the real stdout
+out = sys.stdout
+
+
+def say(s):
+    out.write(s + "\n")
+
+
+def make_links(n):
+    """
+    Returns mqtt_links configuration with n links
+    """
+    links = dict()
+    for ii in range(n):
+        kind = ii % 3
+        if kind == 0:
+            links[CNAME + b"/mosfet/%d" % ii] = [b"MOSFET", [100 + ii, mlc.OFF, 30, mlc.NO_GROUP, mlc.NO_SEQ], []]
+        elif kind == 1:
+            links[CNAME + b"/switch/%d" % ii] = [b"SWITCH", [100 + ii, 60], []]
+        else:
+            links[CNAME + b"/sensor/%d" % ii] = [b"SENSOR_I2C", [BUS, "SI7021", 60], []]
+
+    return links
+
+
+
+def stats(samples):
+    """
+    Returns mean, median, 99th percentile and max of samples in microseconds
+    """
+    samples = sorted(samples)
+    n = len(samples)
+
+    return (sum(samples) / n / 1000, samples[n // 2] / 1000,
+            samples[min(n - 1, n * 99 // 100)] / 1000, samples[-1] / 1000)
+
+
+
+def report(name, samples):
+    say("{:<24} mean {:8.2f} us  p50 {:8.2f} us  p99 {:8.2f} us  max {:8.2f} us".format(name, *stats(samples)))
+
+
+
+def bench_cb(topics, n):
+    """
+    Latency of cb() for status requests, publishing excluded
+
+    Sensors are asked for b"timeout_get", since b"?" could start
+    the conversion
+    """
+    samples = []
+    for ii in range(n):
+        t = topics[ii % len(topics)]
+        if t.startswith(CNAME + b"/sensor"):
+            msg = b"timeout_get"
+        else:
+            msg = b"?"
+        t0 = time.perf_counter_ns()
+        mqtt_link.cb(t, msg)
+        samples.append(time.perf_counter_ns() - t0)
+        mqtt_link.pubq.drain(True)
+
+    report("cb() dispatch", samples)
+
+
+
+def bench_run(topics, n):
+    """
+    Time of run() cycle with one incoming message per cycle
+    """
+    samples = []
+    for ii in range(n):
+        broker.inject(topics[ii % len(topics)], b"?")
+        t0 = time.perf_counter_ns()
+        mqtt_link.run()
+        samples.append(time.perf_counter_ns() - t0)
+        mqtt_link.pubq.drain(True)
+
+    report("run() cycle", samples)
+
+    samples = []
+    for ii in range(n):
+        t0 = time.perf_counter_ns()
+        mqtt_link.run()
+        samples.append(time.perf_counter_ns() - t0)
+
+    report("run() idle cycle", samples)
+
+
+
+def bench_publish(n):
+    """
+    Throughput of publish_status() and queue draining
+    """
+    links = list(mqtt_link.ml.values())
+    t0 = time.perf_counter_ns()
+    for ii in range(n):
+        mqtt_link.publish_status(b"bench", links[ii % len(links)])
+        mqtt_link.pubq.drain(True)
+    dt = time.perf_counter_ns() - t0
+
+    say("{:<24} {:10.0f} msg/s".format("publish throughput", n * 1e9 / dt))
+
+
+
+def bench_alloc(topics, n):
+    """
+    Peak memory allocated while a message is processed and published
+    """
+    tracemalloc.start()
+    total = 0
+    for ii in range(n):
+        t = topics[ii % len(topics)]
+        base = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+        mqtt_link.cb(t, b"?")
+        mqtt_link.pubq.drain(True)
+        total += tracemalloc.get_traced_memory()[1] - base
+    tracemalloc.stop()
+
+    say("{:<24} {:10.1f} bytes/msg".format("allocated per message", total / n))
+
+
+
+def main():
+    ap = argparse.ArgumentParser(description = "mqtt_link benchmarks")
+    ap.add_argument("--links", type = int, default = 30)
+    ap.add_argument("--messages", type = int, default = 1000)
+    args = ap.parse_args()
+
+    sim.add_i2c_device(BUS, sim.Si7021Sim())
+
+    # rate limits would measure the limiter rather than the code
+    mqtt_link.PUB_RATE = 0
+    mqtt_link.PUB_TOPIC_INTERVAL = 0
+    uselect.sleep = False
+
+    with open(os.devnull, "w") as null:
+        sys.stdout = null
+        try:
+            if mqtt_link.init_controller(CNAME, make_links(args.links)) == None:
+                say("Controller initialization failed")
+                return
+            # links are brought up from the main cycle
+            while len(mqtt_link.pending) > 0:
+                mqtt_link.run()
+            broker.keep_log = False
+            # sensor b"?" would measure I2C conversions, so sensors get
+            # only b"timeout_get" in bench_cb and are left out of the others
+            topics = [t for t in mqtt_link.ml.keys() if not t.startswith(CNAME + b"/sensor")]
+
+            say("links: {}  messages: {}".format(args.links, args.messages))
+            bench_cb(list(mqtt_link.ml.keys()), args.messages)
+            bench_run(topics, args.messages)
+            bench_publish(args.messages)
+            bench_alloc(topics, args.messages)
+        finally:
+            sys.stdout = out
+
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+"""
+In-process MQTT broker
+
+(c) Dr. Dobermann, 2018.
+"""
+
+
+def topic_match(flt, topic):
+    """
+    Checks if topic matches subscription filter with + and # wildcards
+    """
+    fl = flt.split(b"/")
+    tl = topic.split(b"/")
+    for ii in range(len(fl)):
+        if fl[ii] == b"#":
+            return True
+        if ii >= len(tl):
+            return False
+        if fl[ii] != b"+" and fl[ii] != tl[ii]:
+            return False
+
+    return len(fl) == len(tl)
+
+
+
+class Broker():
+    """
+    Delivers published messages to subscribed clients' inboxes
+    """
+
+    def __init__(self):
+        self.clients = []
+        # every published message as (topic, msg)
+        self.log = []
+        self.keep_log = True
+        self.published = 0
+        self.subscribes = 0
+        # True while the broker is unreachable
+        self.down = False
+
+    def connect(self, client):
+        if client not in self.clients:
+            self.clients.append(client)
+
+    def disconnect(self, client):
+        if client in self.clients:
+            self.clients.remove(client)
+
+    def subscribe(self, client, flt):
+        self.subscribes += 1
+        if flt not in client.subs:
+            client.subs.append(flt)
+
+    def publish(self, topic, msg):
+        topic = bytes(topic)
+        msg = bytes(msg)
+        self.published += 1
+        if self.keep_log:
+            self.log.append((topic, msg))
+        for c in self.clients:
+            for flt in c.subs:
+                if topic_match(flt, topic):
+                    c.inbox.append((topic, msg))
+                    break
+
+    def inject(self, topic, msg):
+        """
+        Publishes the message as an external client
+        """
+        self.publish(topic, msg)
+
+    def messages(self, topic = None):
+        """
+        Returns logged messages, optionally only on the given topic
+        """
+        if topic == None:
+            return list(self.log)
+
+        return [m for t, m in self.log if t == topic]
+
+    def clear(self):
+        del self.log[:]
+#------------------------------------------------------------------------------
@@ -0,0 +1,115 @@
+"""
+Fake machine module for host-side simulation
+
+(c) Dr. Dobermann, 2018.
+"""
+
+# pin levels by pin id
+levels = dict()
+
+# pins with interrupt handlers by pin id
+irq_pins = dict()
+
+# simulated I2C devices: {(sda, scl): {addr: device}}
+i2c_devices = dict()
+
+# number of the next transactions NACKed by the device: {((sda, scl), addr): n}
+i2c_nacks = dict()
+
+resets = 0
+
+
+class Pin():
+    IN = 0
+    OUT = 1
+    PULL_UP = 1
+    PULL_DOWN = 2
+    IRQ_FALLING = 1
+    IRQ_RISING = 2
+
+    def __init__(self, pin_id, mode = -1, pull = None):
+        self.id = pin_id
+        self.mode = mode
+        self.handler = None
+        self.trigger = 0
+        if pin_id not in levels:
+            levels[pin_id] = 1 if pull == self.PULL_UP else 0
+
+    def value(self, v = None):
+        if v == None:
+            return levels[self.id]
+        levels[self.id] = 1 if v else 0
+
+    def on(self):
+        levels[self.id] = 1
+
+    def off(self):
+        levels[self.id] = 0
+
+    def irq(self, handler = None, trigger = 3):
+        self.handler = handler
+        self.trigger = trigger
+        irq_pins[self.id] = self
+#------------------------------------------------------------------------------
+
+
+
+def drive(pin_id, v):
+    """
+    Sets input pin level from outside and fires its interrupt on the edge
+    """
+    old = levels.get(pin_id, 0)
+    levels[pin_id] = v
+    p = irq_pins.get(pin_id)
+    if p == None or p.handler == None or old == v:
+        return
+    if (v and p.trigger & Pin.IRQ_RISING) or (not v and p.trigger & Pin.IRQ_FALLING):
+        p.handler(p)
+
+
+
+class I2C():
+    def __init__(self, id = -1, sda = None, scl = None, freq = 400000):
+        self.bus = (sda.id, scl.id)
+        self.devices = i2c_devices.setdefault(self.bus, dict())
+        self.transactions = 0
+
+    def dev(self, addr):
+        self.transactions += 1
+        n = i2c_nacks.get((self.bus, addr), 0)
+        if n > 0:
+            i2c_nacks[(self.bus, addr)] = n - 1
+        if addr not in self.devices or n > 0:
+            raise OSError(19) # ENODEV as MicroPython does on NACK
+        return self.devices[addr]
+
+    def scan(self):
+        return sorted(self.devices.keys())
+
+    def readfrom_mem_into(self, addr, reg, buf):
+        data = self.dev(addr).read_mem(reg, len(buf))
+        buf[:] = data
+
+    def readfrom_mem(self, addr, reg, n):
+        return self.dev(addr).read_mem(reg, n)
+
+    def writeto_mem(self, addr, reg, data):
+        self.dev(addr).write_mem(reg, data)
+
+    def writeto(self, addr, data, stop = True):
+        self.dev(addr).write(data)
+        return len(data)
+
+    def readfrom_into(self, addr, buf, stop = True):
+        data = self.dev(addr).read(len(buf))
+        buf[:] = data
+
+    def readfrom(self, addr, n, stop = True):
+        return self.dev(addr).read(n)
+#------------------------------------------------------------------------------
+
+
+
+def reset():
+    global resets
+    resets += 1
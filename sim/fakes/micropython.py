@@ -0,0 +1,19 @@
+"""
+Fake micropython module for host-side simulation
+
+(c) Dr. Dobermann, 2018.
+"""
+
+
+def const(x):
+    return x
+
+
+
+def alloc_emergency_exception_buf(size):
+    pass
+
+
+
+def mem_info(verbose = False):
+    pass
@@ -0,0 +1,7 @@
+"""
+MQTT server configuration for host-side simulation
+
+(c) Dr. Dobermann, 2018.
+"""
+
+mqtt_srv_name = "sim-broker"
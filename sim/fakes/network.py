@@ -0,0 +1,24 @@
+"""
+Fake network module for host-side simulation
+
+WiFi station is connected while connected is True
+
+(c) Dr. Dobermann, 2018.
+"""
+
+STA_IF = 0
+AP_IF = 1
+
+connected = True
+
+
+class WLAN():
+    def __init__(self, interface_id = STA_IF):
+        self.interface_id = interface_id
+
+    def active(self, is_active = None):
+        return True
+
+    def isconnected(self):
+        return connected
+#------------------------------------------------------------------------------
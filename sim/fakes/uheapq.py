@@ -0,0 +1,7 @@
+"""
+Fake uheapq module for host-side simulation
+
+(c) Dr. Dobermann, 2018.
+"""
+
+from heapq import heappush, heappop, heapify
@@ -0,0 +1,86 @@
+"""
+Fake umqtt.simple module for host-side simulation
+
+All clients are connected to the single in-process broker.
+While broker.down is set, connecting and socket operations raise OSError
+
+(c) Dr. Dobermann, 2018.
+"""
+
+from sim.broker import Broker
+
+broker = Broker()
+
+
+class MQTTException(Exception):
+    pass
+
+
+
+class _Sock():
+    def __init__(self, client):
+        self.client = client
+
+    def ready(self):
+        return len(self.client.inbox) > 0
+
+    def close(self):
+        broker.disconnect(self.client)
+        self.client.connected = False
+#------------------------------------------------------------------------------
+
+
+
+class MQTTClient():
+    DEBUG = False
+
+    def __init__(self, client_id, server, port = 0, user = None, password = None,
+                 keepalive = 0, ssl = False, ssl_params = {}):
+        self.client_id = client_id
+        self.server = server
+        self.cb = None
+        self.subs = []
+        self.inbox = []
+        self.sock = None
+        self.connected = False
+
+    def check_link(self):
+        if broker.down or not self.connected:
+            self.connected = False
+            raise OSError(104) # ECONNRESET
+
+    def connect(self, clean_session = True):
+        if broker.down:
+            raise OSError(113) # EHOSTUNREACH
+        self.sock = _Sock(self)
+        broker.connect(self)
+        self.connected = True
+        return 0
+
+    def disconnect(self):
+        broker.disconnect(self)
+        self.connected = False
+
+    def set_callback(self, f):
+        self.cb = f
+
+    def subscribe(self, topic, qos = 0):
+        self.check_link()
+        broker.subscribe(self, topic)
+
+    def publish(self, topic, msg, retain = False, qos = 0):
+        self.check_link()
+        broker.publish(topic, msg)
+
+    def check_msg(self):
+        self.check_link()
+        if len(self.inbox) > 0:
+            topic, msg = self.inbox.pop(0)
+            self.cb(topic, msg)
+
+    def wait_msg(self):
+        self.check_msg()
+
+    def ping(self):
+        self.check_link()
+#------------------------------------------------------------------------------
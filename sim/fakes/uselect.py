@@ -0,0 +1,37 @@
+"""
+Fake uselect module for host-side simulation
+
+Works only with fake mqtt client sockets
+
+(c) Dr. Dobermann, 2018.
+"""
+
+import time
+
+POLLIN = 1
+POLLOUT = 4
+
+# when False poll() doesn't sleep at all
+sleep = True
+
+
+class _Poll():
+    def __init__(self):
+        self.socks = []
+
+    def register(self, sock, mask = POLLIN):
+        self.socks.append(sock)
+
+    def unregister(self, sock):
+        self.socks.remove(sock)
+
+    def poll(self, timeout = -1):
+        ready = [(s, POLLIN) for s in self.socks if s.ready()]
+        if len(ready) == 0 and sleep and timeout > 0:
+            time.sleep(timeout / 1000)
+        return ready
+
+
+
+def poll():
+    return _Poll()
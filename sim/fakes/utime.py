@@ -0,0 +1,45 @@
+"""
+Fake utime module for host-side simulation
+
+Ticks wrap around like MicroPython's ones. offset shifts the ticks
+to test the wraparound
+
+(c) Dr. Dobermann, 2018.
+"""
+
+import time as _time
+
+TICKS_PERIOD = 1 << 30
+TICKS_MAX = TICKS_PERIOD - 1
+TICKS_HALF = TICKS_PERIOD // 2
+
+offset = 0
+_start = _time.monotonic_ns()
+
+
+def ticks_ms():
+    return ((_time.monotonic_ns() - _start) // 1000000 + offset) & TICKS_MAX
+
+def ticks_us():
+    return ((_time.monotonic_ns() - _start) // 1000 + offset * 1000) & TICKS_MAX
+
+def ticks_cpu():
+    return ticks_us()
+
+def ticks_add(t, delta):
+    return (t + delta) & TICKS_MAX
+
+def ticks_diff(t1, t2):
+    return ((t1 - t2 + TICKS_HALF) & TICKS_MAX) - TICKS_HALF
+
+def sleep_ms(ms):
+    _time.sleep(ms / 1000)
+
+def sleep_us(us):
+    _time.sleep(us / 1000000)
+
+def sleep(s):
+    _time.sleep(s)
+
+def time():
+    return int(_time.time())
@@ -0,0 +1,88 @@
+"""
+Simulated I2C sensors
+
+Devices emulate registers and commands used by sensors.i2c drivers
+
+(c) Dr. Dobermann, 2018.
+"""
+
+import struct
+
+
+class BMP280Sim():
+    """
+    BMP-280 registers emulation
+
+    Calibration and raw data are the example values from the datasheet
+    which give 25.08 C and 100653.25 Pa
+    """
+    CALIB = (27504, 26435, -1000,
+             36477, -10685, 3024, 2855, 140, -7, 15500, -14600, 6000)
+
+    def __init__(self, addr = 0x76, raw_t = 519888, raw_p = 415148):
+        self.addr = addr
+        self.regs = bytearray(256)
+        self.regs[0xD0] = 0x58 # chip id
+        struct.pack_into("<HhhHhhhhhhhh", self.regs, 0x88, *self.CALIB)
+        self.set_raw(raw_t, raw_p)
+        self.conversions = 0
+
+    def set_raw(self, raw_t, raw_p):
+        """
+        Sets 20 bit raw temperature and pressure ADC values
+        """
+        for base, v in ((0xF7, raw_p), (0xFA, raw_t)):
+            self.regs[base] = (v >> 12) & 0xFF
+            self.regs[base + 1] = (v >> 4) & 0xFF
+            self.regs[base + 2] = (v << 4) & 0xF0
+
+    def write_mem(self, reg, data):
+        for ii in range(len(data)):
+            self.regs[reg + ii] = data[ii]
+        if reg == 0xF4:
+            self.conversions += 1
+
+    def read_mem(self, reg, n):
+        return bytes(self.regs[reg:reg + n])
+
+    def write(self, data):
+        pass
+
+    def read(self, n):
+        return bytes(n)
+#------------------------------------------------------------------------------
+
+
+
+class Si7021Sim():
+    """
+    Si7021-A20 commands emulation
+    """
+
+    def __init__(self, addr = 0x40, rhum = 45.2, temp = 21.1):
+        self.addr = addr
+        self.rhum = rhum
+        self.temp = temp
+        self.out = bytes(2)
+        self.conversions = 0
+
+    def write(self, data):
+        cmd = data[0]
+        if cmd in (0xF5, 0xE5):
+            self.conversions += 1
+            code = int((self.rhum + 6) * 65536 / 125)
+        elif cmd in (0xE0, 0xF3, 0xE3):
+            code = int((self.temp + 46.85) * 65536 / 175.72)
+        else:
+            return
+        self.out = bytes(((code >> 8) & 0xFF, code & 0xFC))
+
+    def read(self, n):
+        return self.out[:n]
+
+    def write_mem(self, reg, data):
+        pass
+
+    def read_mem(self, reg, n):
+        return bytes(n)
+#------------------------------------------------------------------------------
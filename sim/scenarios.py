@@ -0,0 +1,142 @@
+"""
+Scenarios over the host-side simulation harness
+
+    python -m sim.scenarios
+
+Every failure scenario drives the controller through a failure and checks
+it recovers without stuck links or busy spinning of the main cycle.
+Scenario links are on their own I2C buses, so they run together.
+Sensor drivers are checked against their datasheet examples as well
+
+(c) Dr. Dobermann, 2018.
+"""
+
+import os
+import sys
+import time
+
+import sim
+
+broker = sim.install()
+
+import mqtt_link
+from sensors.i2c import i2c_buses, get_sensor
+
+CNAME = b"scn"
+SI7021_ADDR = 0x40
+
+# BMP-280 datasheet compensation example
+BMP_BUS = (9, 8)
+BMP_TEMP = 25.08   # C
+BMP_PRES = 100653.25 # Pa, 64 bit integer formula, the float one gives 100653.27
+
+# transient NACK: the sensor fails two conversions and recovers
+NACK_BUS = (5, 4)
+NACK_TOPIC = CNAME + b"/nack"
+# dead sensor: the link gives up after mqtt_link.SENSOR_MAX_FAILURES
+DEAD_BUS = (7, 6)
+DEAD_TOPIC = CNAME + b"/dead"
+
+PERIOD = 1        # seconds
+RUN_TIME = 6.5    # seconds, longer than SENSOR_MAX_FAILURES periods
+# run() cycles in RUN_TIME above this limit mean busy spinning
+MAX_CYCLES = 200
+
+# controller debug output goes to devnull, results to the real stdout
+out = sys.stdout
+failures = 0
+
+
+def check(name, ok, info = ""):
+    global failures
+
+    if not ok:
+        failures += 1
+    out.write("{:<48} {} {}\n".format(name, "OK" if ok else "FAIL", info))
+
+
+
+def run_for(t):
+    """
+    Runs the main cycle for t seconds, returns the number of cycles
+    """
+    n = 0
+    end = time.monotonic() + t
+    while time.monotonic() < end:
+        mqtt_link.run()
+        mqtt_link.idle()
+        n += 1
+
+    return n
+
+
+
+def check_bmp280():
+    """
+    BMP-280 compensation of the datasheet raw values
+    """
+    sim.add_i2c_device(BMP_BUS, sim.BMP280Sim())
+    s = get_sensor(BMP_BUS[0], BMP_BUS[1], "BMP-280")
+    s.update()
+    s.get_value()
+    check("BMP-280 datasheet temperature", abs(s.temp - BMP_TEMP) < 0.005, s.temp)
+    check("BMP-280 datasheet pressure", abs(s.pressure - BMP_PRES) < 0.01, s.pressure)
+
+
+
+def main():
+    sim.add_i2c_device(NACK_BUS, sim.Si7021Sim())
+    sim.add_i2c_device(DEAD_BUS, sim.Si7021Sim())
+    links = {NACK_TOPIC: [b"SENSOR_I2C", [NACK_BUS, "SI7021", PERIOD], []],
+             DEAD_TOPIC: [b"SENSOR_I2C", [DEAD_BUS, "SI7021", PERIOD], []]}
+
+    with open(os.devnull, "w") as null:
+        sys.stdout = null
+        try:
+            if mqtt_link.init_controller(CNAME, links) == None:
+                check("controller initialization", False)
+                return
+            while len(mqtt_link.pending) > 0:
+                mqtt_link.run()
+            check_bmp280()
+
+            sim.nack_i2c(NACK_BUS, SI7021_ADDR, 2)
+            sim.nack_i2c(DEAD_BUS, SI7021_ADDR, 1000)
+            broker.clear()
+            cycles = run_for(RUN_TIME)
+
+            nack = broker.messages(NACK_TOPIC + b"/status")
+            errors = [m for m in nack if m.startswith(b"ERROR")]
+            check("transient NACK: errors reported", len(errors) == 2, nack)
+            check("transient NACK: readings after recovery",
+                  len(nack) > 2 and not nack[-1].startswith(b"ERROR"), nack[-1:])
+            check("transient NACK: link isn't failed", not mqtt_link.ml[NACK_TOPIC].failed)
+            check("transient NACK: bus queues are empty",
+                  len(i2c_buses[NACK_BUS].converting) == 0 and
+                  len(i2c_buses[NACK_BUS].starting) == 0)
+
+            dead = broker.messages(DEAD_TOPIC + b"/status")
+            check("dead sensor: link is failed",
+                  mqtt_link.ml[DEAD_TOPIC].failed and dead[-1:] == [b"FAILED"], dead[-1:])
+            check("dead sensor: bus errors counted",
+                  i2c_buses[DEAD_BUS].errors == mqtt_link.SENSOR_MAX_FAILURES,
+                  i2c_buses[DEAD_BUS].errors)
+            check("no busy spinning", cycles < MAX_CYCLES, "{} cycles".format(cycles))
+
+            # failed link still answers b"?" and gets back once the sensor does
+            sim.nack_i2c(DEAD_BUS, SI7021_ADDR, 0)
+            broker.inject(DEAD_TOPIC, b"?")
+            run_for(PERIOD)
+            check("dead sensor: recovered on ?", not mqtt_link.ml[DEAD_TOPIC].failed,
+                  broker.messages(DEAD_TOPIC + b"/status")[-1:])
+        finally:
+            sys.stdout = out
+
+    out.write("{} failed\n".format(failures))
+    if failures > 0:
+        sys.exit(1)
+
+
+
+if __name__ == "__main__":
+    main()